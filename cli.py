@@ -2,9 +2,17 @@ import argparse
 import asyncio
 from pathlib import Path
 from process import process_csv
+from translator import close_clients
 
 async def main_cli():
-    parser = argparse.ArgumentParser(description="Translate a CSV file using an Ollama LLM.")
+    parser = argparse.ArgumentParser(
+        description="Translate a CSV file using an Ollama LLM.",
+        epilog=(
+            "Environment variables: OLLAMA_NUM_PARALLEL sets how many translation requests are kept "
+            "in flight at once (default: 4). Match it to the OLLAMA_NUM_PARALLEL setting of the Ollama "
+            "server, and keep OLLAMA_MAX_LOADED_MODELS on the server high enough that the model stays loaded."
+        ),
+    )
     parser.add_argument("csv_path", type=str, help="Path to the input CSV file.")
     parser.add_argument("source_lang", type=str, help="Source language.")
     parser.add_argument("target_lang", type=str, help="Target language.")
@@ -13,7 +21,10 @@ async def main_cli():
     parser.add_argument("--batch-size", type=int, default=10, help="Number of rows to process before saving.")
     parser.add_argument("--overwrite", action='store_true', help="Overwrite existing translations. If false, only translates rows with empty target.")
     # 新增的參數
-    parser.add_argument("--glossary", type=str, default=None, help="Path to the optional glossary CSV file.")
+    parser.add_argument("--glossary", type=str, default=None, help=(
+        "Path to the optional glossary CSV file. Its terms are matched against every source text "
+        "in a single pass, and only the terms found are added to that text's prompt."
+    ))
 
     args = parser.parse_args()
 
@@ -28,16 +39,20 @@ async def main_cli():
         print(f"Error: Glossary file not found at {glossary_path}")
         return
 
-    await process_csv(
-        csv_path=input_path,
-        source_lang=args.source_lang,
-        target_lang=args.target_lang,
-        ollama_host=args.ollama_host,
-        model=args.model,
-        batch_size=args.batch_size,
-        overwrite=args.overwrite,
-        glossary_path=glossary_path # 傳遞 glossary 路徑
-    )
+    try:
+        await process_csv(
+            csv_path=input_path,
+            source_lang=args.source_lang,
+            target_lang=args.target_lang,
+            ollama_host=args.ollama_host,
+            model=args.model,
+            batch_size=args.batch_size,
+            overwrite=args.overwrite,
+            glossary_path=glossary_path # 傳遞 glossary 路徑
+        )
+    finally:
+        # Close the pooled connections even if translating failed or was interrupted
+        await close_clients()
 
 if __name__ == "__main__":
     asyncio.run(main_cli())
\ No newline at end of file
@@ -1,5 +1,8 @@
 # dependencies.py
-from typing import List
+import time
+from hashlib import blake2b
+from functools import lru_cache
+from typing import FrozenSet
 from fastapi import Depends, HTTPException
 from fastapi.security import APIKeyHeader
 from starlette.status import HTTP_401_UNAUTHORIZED, HTTP_500_INTERNAL_SERVER_ERROR
@@ -8,35 +11,44 @@ from token_manager import get_tokens
 
 API_KEY_HEADER = APIKeyHeader(name="X-API-Token", auto_error=False)
 
-def get_valid_tokens() -> List[str]:
+# How long a loaded token set is reused before api_tokens.json is read again
+TOKEN_CACHE_TTL_SECONDS = 5
+
+def token_digest(token: str) -> bytes:
+    """Returns the fixed-size digest that tokens are compared by."""
+    return blake2b(token.encode('utf-8'), digest_size=16).digest()
+
+@lru_cache(maxsize=1)
+def _load_valid_tokens(ttl_bucket: int) -> FrozenSet[bytes]:
+    # `ttl_bucket` only changes every TOKEN_CACHE_TTL_SECONDS, which invalidates the cached set
+    return frozenset(token_digest(token) for token in get_tokens())
+
+def get_valid_token_digests() -> FrozenSet[bytes]:
     """
-    Reads tokens from api_tokens.json via the token_manager.
-    This runs on each request, ensuring the token list is always fresh.
+    Returns the digests of the tokens in api_tokens.json.
+    The parsed set is cached for a few seconds, so requests don't hit the disk
+    while newly added tokens are still picked up quickly.
     """
-    tokens = get_tokens()
-    if not tokens:
-        raise HTTPException(
-            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="No API tokens found in api_tokens.json or the file is invalid."
-        )
-    return tokens
+    return _load_valid_tokens(int(time.monotonic() // TOKEN_CACHE_TTL_SECONDS))
 
-async def get_current_api_token(api_key: str = Depends(API_KEY_HEADER), valid_tokens: List[str] = Depends(get_valid_tokens)) -> str:
+async def get_current_api_token(api_key: str = Depends(API_KEY_HEADER)) -> str:
     """
-    Validates the provided API key against the list of valid tokens.
+    Validates the provided API key against the set of valid tokens.
     Returns the valid API key if it exists.
     """
-    if api_key is None or api_key not in valid_tokens:
+    valid_tokens = get_valid_token_digests()
+    if not valid_tokens:
+        raise HTTPException(
+            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="No API tokens found in api_tokens.json or the file is invalid."
+        )
+    # Only digests are compared, so the lookup time says nothing about the stored tokens
+    if api_key is None or token_digest(api_key) not in valid_tokens:
         raise HTTPException(
             status_code=HTTP_401_UNAUTHORIZED, 
             detail="Invalid or missing API Token"
         )
     return api_key
 
-# For backward compatibility, we can have a simple verification dependency
-async def verify_api_token(api_key: str = Depends(get_current_api_token)):
-    """
-    A simple dependency that just verifies the token without returning it.
-    Useful for routes that need protection but don't need the token itself.
-    """
-    pass
+# For backward compatibility; routes that only need protection use it in `dependencies=[...]`
+verify_api_token = get_current_api_token
@@ -1,35 +1,49 @@
+import csv
+import multiprocessing
+import re
+import shutil
 import zipfile
-import xml.etree.ElementTree as ET
+from lxml import etree as ET
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
+from typing import BinaryIO, Dict, List, TextIO, Union
 import io
 
-def extract_idml_to_csv(idml_file_path: Path) -> str:
-    """
-    Extracts all user-facing text from an IDML file and returns it as a CSV string.
-
-    Args:
-        idml_file_path: The path to the .idml file.
-
-    Returns:
-        A string containing the data in CSV format with 'source' and 'target' columns.
-    """
+# Compiled once and reused for every story
+_CONTENT_XPATH = ET.XPath("//CharacterStyleRange/Content")
+_STORY_RE = re.compile(r"^Stories/Story_[^/]+\.xml$")
+ZIP_COPY_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+# Deflate level for rewritten entries. Level 1 is several times faster than zlib's default
+# and makes the XML-heavy package only slightly larger; InDesign reads any level.
+ZIP_COMPRESS_LEVEL = 1
+# Packages with more story XML than this are patched in worker processes. Below it, starting
+# the processes costs more than the GIL contention they avoid, so threads are used instead.
+PROCESS_POOL_MIN_STORY_BYTES = 32 * 1024 * 1024  # 32 MiB
+
+# Inputs can be paths or seekable binary file objects, e.g. an `UploadFile.file`
+IdmlSource = Union[Path, BinaryIO]
+
+def _extract_unique_texts(idml_file_path: IdmlSource) -> List[str]:
+    """Returns the distinct user-facing texts of an IDML file, in document order."""
     stories_content = []
 
     try:
         with zipfile.ZipFile(idml_file_path, 'r') as z:
             # Find all story files
-            story_files = [f for f in z.namelist() if f.startswith('Stories/Story_') and f.endswith('.xml')]
+            story_files = list(filter(_STORY_RE.match, z.namelist()))
 
             for story_file in story_files:
                 with z.open(story_file) as xml_file:
-                    tree = ET.parse(xml_file)
-                    root = tree.getroot()
+                    # Stream the story instead of building the full tree.
                     # IDML text is within <Content> tags inside <CharacterStyleRange>
-                    for content_tag in root.findall(".//CharacterStyleRange/Content"):
-                        if content_tag.text:
+                    for _, content_tag in ET.iterparse(xml_file, tag="Content"):
+                        parent = content_tag.getparent()
+                        if content_tag.text and parent is not None and parent.tag == "CharacterStyleRange":
                             # Append the text content, preserving whitespace
                             stories_content.append(content_tag.text)
+                        content_tag.clear()
     except zipfile.BadZipFile:
         raise ValueError("Invalid IDML file: Not a valid zip archive.")
     except ET.ParseError:
@@ -39,67 +53,140 @@ def extract_idml_to_csv(idml_file_path: Path) -> str:
     stories_content = [text for text in stories_content if text]
 
     # --- NEW: Deduplicate the list while preserving order ---
-    unique_stories = list(dict.fromkeys(stories_content))
+    return list(dict.fromkeys(stories_content))
 
-    if not unique_stories:
-        return "source,target\n"
+def _write_csv(texts: List[str], csv_file: TextIO):
+    # Write the two columns straight to CSV; the target column starts out empty
+    writer = csv.writer(csv_file, lineterminator='\n')
+    writer.writerow(('source', 'target'))
+    writer.writerows((text, '') for text in texts)
 
-    # Create a pandas DataFrame from the unique list
-    df = pd.DataFrame({
-        'source': unique_stories,
-        'target': [''] * len(unique_stories) # Add an empty target column
-    })
+def extract_idml_to_csv(idml_file_path: IdmlSource) -> str:
+    """
+    Extracts all user-facing text from an IDML file and returns it as a CSV string.
+
+    Args:
+        idml_file_path: The path to the .idml file, or an open binary file object.
 
-    # Convert DataFrame to CSV string
+    Returns:
+        A string containing the data in CSV format with 'source' and 'target' columns.
+    """
     csv_buffer = io.StringIO()
-    df.to_csv(csv_buffer, index=False, encoding='utf-8-sig')
-    
+    _write_csv(_extract_unique_texts(idml_file_path), csv_buffer)
     return csv_buffer.getvalue()
 
-def rebuild_idml_from_csv(original_idml_path: Path, translated_csv_path: Path) -> bytes:
+def extract_idml_to_csv_file(idml_file_path: IdmlSource, output_path: Path):
+    """
+    Like `extract_idml_to_csv`, but writes the CSV to `output_path` instead of returning it.
+    The file starts with a BOM so Excel detects the UTF-8 encoding.
+    """
+    texts = _extract_unique_texts(idml_file_path)
+    with open(output_path, 'w', encoding='utf-8-sig', newline='') as csv_file:
+        _write_csv(texts, csv_file)
+
+def _patch_story(story_xml: bytes, translation_map: Dict[str, str]) -> bytes:
+    """
+    Replaces the text of every <Content> tag found in the translation map and returns the new story XML.
+    """
+    root = ET.fromstring(story_xml)
+    for content_tag in _CONTENT_XPATH(root):
+        original_text = content_tag.text
+        if not original_text:
+            continue
+        # The map only holds non-empty translations, so a hit is always safe to apply
+        translated_text = translation_map.get(original_text)
+        if translated_text:
+            content_tag.text = translated_text
+
+    # Serialize the (potentially modified) story, keeping IDML's `standalone="yes"` prolog
+    tree = root.getroottree()
+    return ET.tostring(tree, encoding='UTF-8', xml_declaration=True, standalone=tree.docinfo.standalone)
+
+# The translation map is handed to each worker process once, instead of with every story
+_worker_translation_map: Dict[str, str] = {}
+
+def _init_patch_worker(translation_map: Dict[str, str]):
+    global _worker_translation_map
+    _worker_translation_map = translation_map
+
+def _patch_story_in_worker(story_xml: bytes) -> bytes:
+    return _patch_story(story_xml, _worker_translation_map)
+
+def _patch_stories(story_xmls: List[bytes], translation_map: Dict[str, str]) -> List[bytes]:
+    """
+    Patches every story, in parallel. Large packages are spread over worker processes to
+    use all cores; smaller ones use threads, as lxml releases the GIL while parsing and serializing.
+    """
+    if sum(map(len, story_xmls)) >= PROCESS_POOL_MIN_STORY_BYTES:
+        # forkserver children start clean instead of inheriting the server's threads
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        try:
+            with ProcessPoolExecutor(
+                mp_context=multiprocessing.get_context(start_method),
+                initializer=_init_patch_worker,
+                initargs=(translation_map,),
+            ) as executor:
+                return list(executor.map(_patch_story_in_worker, story_xmls))
+        except (OSError, BrokenProcessPool) as e:
+            print(f"Process pool unavailable ({e}); patching IDML stories in threads instead.")
+
+    with ThreadPoolExecutor() as executor:
+        return list(executor.map(lambda xml: _patch_story(xml, translation_map), story_xmls))
+
+def rebuild_idml_from_csv(original_idml_path: IdmlSource, translated_csv_path: IdmlSource) -> bytes:
     """
     Rebuilds an IDML file by replacing text content with translations from a CSV.
+    Both inputs can be paths or open binary file objects.
     """
+    zip_buffer = io.BytesIO()
+    _rebuild_idml(original_idml_path, translated_csv_path, zip_buffer)
+    return zip_buffer.getvalue()
+
+def rebuild_idml_to_file(original_idml_path: IdmlSource, translated_csv_path: IdmlSource, output_path: Path):
+    """
+    Like `rebuild_idml_from_csv`, but writes the package to `output_path`, so it's never held in memory.
+    """
+    _rebuild_idml(original_idml_path, translated_csv_path, output_path)
+
+def _rebuild_idml(original_idml_path: IdmlSource, translated_csv_path: IdmlSource, destination: Union[Path, BinaryIO]):
     # 1. Read translated CSV into a lookup dictionary
     try:
-        df = pd.read_csv(translated_csv_path, encoding='utf-8-sig')
-        # Ensure columns exist and handle potential NaN values
+        # Read every cell as a plain string so sources like "01" or "N/A" are matched verbatim
+        df = pd.read_csv(translated_csv_path, dtype=str, keep_default_na=False, encoding='utf-8-sig')
+        # Ensure columns exist
         if 'source' not in df.columns or 'target' not in df.columns:
             raise ValueError("CSV must contain 'source' and 'target' columns.")
-        df['source'] = df['source'].astype(str).fillna('')
-        # Replace NaN in target with empty strings for safe processing
-        df['target'] = df['target'].fillna('').astype(str)
-        translation_map = dict(zip(df.source, df.target))
+        # Only rows with a translation are useful; for duplicated sources the last row wins
+        translated_rows = df[df['target'] != '']
+        translation_map = (
+            translated_rows.drop_duplicates('source', keep='last')
+            .set_index('source')['target']
+            .to_dict()
+        )
     except Exception as e:
         raise ValueError(f"Error reading or processing CSV file: {e}")
 
-    # In-memory buffer for the new zip file
-    zip_buffer = io.BytesIO()
-
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as new_zip:
-        with zipfile.ZipFile(original_idml_path, 'r') as old_zip:
-            for item in old_zip.infolist():
-                # If the item is not a story XML, copy it directly
-                if not (item.filename.startswith('Stories/Story_') and item.filename.endswith('.xml')):
-                    new_zip.writestr(item, old_zip.read(item.filename))
-                    continue
-
-                # If it is a story XML, process it
-                tree = ET.parse(old_zip.open(item.filename))
-                root = tree.getroot()
-
-                for content_tag in root.findall(".//CharacterStyleRange/Content"):
-                    original_text = content_tag.text if content_tag.text else ""
-                    if original_text in translation_map:
-                        translated_text = translation_map[original_text]
-                        # CRITICAL: Only replace if the translation is a non-empty string
-                        if translated_text and isinstance(translated_text, str):
-                            content_tag.text = translated_text
-                
-                # Write the (potentially modified) XML tree to the new zip
-                xml_buffer = io.BytesIO()
-                tree.write(xml_buffer, encoding='UTF-8', xml_declaration=True)
-                new_zip.writestr(item.filename, xml_buffer.getvalue())
-
-    zip_buffer.seek(0)
-    return zip_buffer.getvalue()
+    with zipfile.ZipFile(original_idml_path, 'r') as old_zip:
+        items = old_zip.infolist()
+        story_items = [item for item in items if _STORY_RE.match(item.filename)]
+        story_xmls = [old_zip.read(item) for item in story_items]
+
+        # 2. Patch the stories concurrently. zipfile writes are not thread-safe,
+        #    so the results are written out sequentially below.
+        patched_xmls = _patch_stories(story_xmls, translation_map)
+        patched_stories = dict(zip((item.filename for item in story_items), patched_xmls))
+
+        # 3. Write the new package. Every entry keeps its original ZipInfo (and therefore its
+        #    compression type, e.g. IDML's uncompressed `mimetype`); only the stories are deflated.
+        with zipfile.ZipFile(destination, 'w', zipfile.ZIP_STORED) as new_zip:
+            for item in items:
+                if item.filename in patched_stories:
+                    new_zip.writestr(item, patched_stories[item.filename], compress_type=zipfile.ZIP_DEFLATED, compresslevel=ZIP_COMPRESS_LEVEL)
+                elif item.file_size <= ZIP_COPY_CHUNK_SIZE:
+                    # Small entries (spreads, styles, metadata) are copied in one go at the fast level
+                    new_zip.writestr(item, old_zip.read(item), compresslevel=ZIP_COMPRESS_LEVEL)
+                else:
+                    # If the item is not a story XML, copy it directly, streaming in 1 MiB chunks
+                    # so large embedded assets are never held in memory as a whole
+                    with old_zip.open(item) as src, new_zip.open(item, 'w') as dst:
+                        shutil.copyfileobj(src, dst, ZIP_COPY_CHUNK_SIZE)
@@ -1,28 +1,30 @@
 # main.py
 import uvicorn
 import asyncio
-import os
 from contextlib import asynccontextmanager
 from pathlib import Path
 
-from dotenv import load_dotenv
 from fastapi import FastAPI, Request
 from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
 
+from settings import get_settings
+
 # --- Pre-flight checks and environment loading ---
-load_dotenv()
+settings = get_settings()
 # The API token check is now handled by the token_manager
-if not os.getenv("OLLAMA_HOST") or not os.getenv("OLLAMA_MODEL"):
+if not settings.ollama_host or not settings.ollama_model:
     print("FATAL: OLLAMA_HOST or OLLAMA_MODEL not found in .env file. The application cannot start.")
     exit(1)
 
 # --- Local Module Imports ---
 # These must come after the dotenv load
-from storage import initialize_tasks_file
-from worker import run_background_worker, get_running_tasks_dict
+from storage import initialize_tasks_file, flush_tasks
+from worker import start_background_worker, stop_background_worker
 from routers import tasks, idml, live, ws
 from token_manager import initialize_token_file
+from translator import warm_up_client, close_clients
+from upload_utils import init_upload_slots, run_upload_gc, UploadSizeLimitMiddleware
 
 # --- App Lifecycle (Lifespan) ---
 @asynccontextmanager
@@ -31,32 +33,46 @@ async def lifespan(app: FastAPI):
     Manages application startup and shutdown events.
     """
     print("Application starting up...")
-    Path("uploads").mkdir(exist_ok=True) # Ensure uploads directory exists
-    initialize_tasks_file()
-    initialize_token_file() # Ensure the token file exists
+    # Run the filesystem setup off the event loop; slow (e.g. network) disks shouldn't stall startup
+    await asyncio.gather(
+        asyncio.to_thread(Path("uploads").mkdir, exist_ok=True), # Ensure uploads directory exists
+        asyncio.to_thread(initialize_tasks_file),
+        asyncio.to_thread(initialize_token_file), # Ensure the token file exists
+    )
+    # Create the shared Ollama client and open a connection up front, so the first request
+    # doesn't pay for it. Runs in the background, as Ollama being slow or down shouldn't block startup.
+    warm_up_task = asyncio.create_task(warm_up_client(settings.ollama_host, settings.ollama_model))
     
-    # Start the background worker, passing it the WebSocket manager from the ws router
-    worker_task = asyncio.create_task(run_background_worker(ws.manager))
+    # Start the background worker, passing it the WebSocket manager from the ws router.
+    # Its queue and the upload slots are created here, as they belong to this event loop.
+    init_upload_slots()
+    worker_task = start_background_worker(ws.manager)
+    # Clean up files that were left behind by failed requests or deleted tasks
+    upload_gc_task = asyncio.create_task(run_upload_gc(Path("uploads")))
     
     yield
     
     print("Application shutting down...")
     # --- Graceful Shutdown ---
-    # 1. Cancel the main worker loop
-    worker_task.cancel()
+    # 1. Cancel the upload cleanup and the Ollama warm-up
+    upload_gc_task.cancel()
+    warm_up_task.cancel()
     
-    # 2. Cancel all tasks that were running inside the worker
-    running_tasks = get_running_tasks_dict()
-    if running_tasks:
-        print(f"Cancelling {len(running_tasks)} running tasks...")
-        for task in running_tasks.values():
-            task.cancel()
-        # Wait for all cancellations to complete
-        await asyncio.gather(*running_tasks.values(), return_exceptions=True)
+    # 2. Stop the worker and all tasks that were running inside it; they are requeued for the next start
+    await stop_background_worker(worker_task)
+
+    # 3. Close the shared Ollama connection pools
+    await close_clients()
+
+    # 4. Make sure the final task states have been written to tasks.json
+    await flush_tasks()
 
     print("Background worker and all running tasks have been stopped.")
 
 
+# Largest WebSocket message accepted from a client
+WS_MAX_MESSAGE_BYTES = 64 * 1024
+
 # --- FastAPI App Initialization ---
 app = FastAPI(
     title="Dingo",
@@ -65,6 +81,14 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Turn away oversized uploads before their body is read. IDML packages are often far larger
+# than task CSVs, so the IDML tools have their own, higher limit.
+app.add_middleware(UploadSizeLimitMiddleware, limits={
+    "/tasks/upload": settings.max_upload_bytes,
+    "/idml/extract": settings.max_idml_upload_bytes,
+    "/idml/rebuild": settings.max_idml_upload_bytes,
+})
+
 # --- Mount Static Files ---
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -82,4 +106,5 @@ async def read_root(request: Request):
 
 # --- Main Entry Point ---
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Clients never send real messages over the WebSocket, so a small frame limit is plenty
+    uvicorn.run(app, host="0.0.0.0", port=8000, ws_max_size=WS_MAX_MESSAGE_BYTES)
@@ -1,28 +1,64 @@
 import asyncio
-import pandas as pd
-import ollama
+import hashlib
 import io
-import zipfile
-import xml.etree.ElementTree as ET
+import itertools
+import os
+import time
+import numpy as np
+import pandas as pd
 from pathlib import Path
-from translator import translate_text
-from idml_processor import extract_idml_to_csv
-from typing import Callable, Awaitable, Dict
+from settings import get_settings
+from translator import translate_text, translate_batch, get_client, GlossaryMatcher
+from collections import OrderedDict
+from typing import Callable, Awaitable, Dict, Optional
 
 # Define the type for the progress callback function
 ProgressCallback = Callable[[int, int], Awaitable[None]]
 
-def load_glossary(glossary_path: Path) -> Dict[str, Dict[str, str]]:
+# --- CSV parsing ---
+# With the optional pyarrow package (`fast` extra), CSVs are parsed by its multithreaded reader
+# into compact Arrow string columns; otherwise pandas' own C parser is used.
+# Every column is read as text either way, so values like "01" are kept verbatim.
+try:
+    import pyarrow as pa
+    _FAST_CSV_READ_OPTIONS = {"engine": "pyarrow", "dtype": pd.ArrowDtype(pa.string())}
+except ImportError:
+    _FAST_CSV_READ_OPTIONS = None
+
+def _read_csv(csv_path: Path) -> pd.DataFrame:
+    if _FAST_CSV_READ_OPTIONS:
+        try:
+            return pd.read_csv(csv_path, encoding='utf-8-sig', **_FAST_CSV_READ_OPTIONS).fillna('')
+        except pd.errors.ParserError:
+            # pyarrow rejects rows with missing trailing cells, which spreadsheet exports often
+            # have; pandas' parser accepts them and leaves the cells empty
+            pass
+    return pd.read_csv(csv_path, dtype=str, encoding='utf-8-sig').fillna('')
+
+# Minimum time between two full rewrites of the `_processed.csv` checkpoint
+CHECKPOINT_INTERVAL_SECONDS = 10
+# Large files take long to rewrite; their checkpoints are spaced out so that writing
+# never takes more than this fraction of the task's running time
+CHECKPOINT_MAX_TIME_SHARE = 0.05
+# Minimum time between two progress reports; fast models can finish many batches per second
+PROGRESS_INTERVAL_SECONDS = 0.5
+# How many translation requests per OLLAMA_NUM_PARALLEL slot exist at a time; the extra ones
+# are ready to start as soon as a slot frees up
+PIPELINE_WINDOW_FACTOR = 2
+
+# How many glossaries (by content) keep their prebuilt GlossaryMatcher around for later tasks
+GLOSSARY_CACHE_SIZE = 16
+_glossary_matchers: "OrderedDict[bytes, GlossaryMatcher]" = OrderedDict()
+
+def _parse_glossary(source, glossary_path: Path) -> Dict[str, Dict[str, str]]:
     """
-    Loads a glossary from a CSV file into a dictionary format.
+    Loads a glossary CSV (read from `source`) into a dictionary format.
     The first column should be 'English' or the base language for indexing.
     """
-    if not glossary_path or not glossary_path.exists():
-        return None
     try:
-        glossary_df = pd.read_csv(glossary_path, encoding='utf-8-sig')
-        glossary_df = glossary_df.where(pd.notna(glossary_df), None)
-        
+        # Empty cells stay NaN; GlossaryMatcher.translations_for leaves them out
+        glossary_df = pd.read_csv(source, encoding='utf-8-sig')
+
         english_col = glossary_df.columns[0]
         if english_col != 'en':
             print(f"Warning: Glossary's first column is '{english_col}', not 'en'. Using it as the base language.")
@@ -34,26 +70,86 @@ def load_glossary(glossary_path: Path) -> Dict[str, Dict[str, str]]:
         print(f"Error loading glossary from {glossary_path}: {e}")
         return None
 
+def _read_glossary_file(glossary_path: Path) -> Optional[bytes]:
+    try:
+        return glossary_path.read_bytes()
+    except FileNotFoundError:
+        return None
+
+def _build_glossary_matcher(content: bytes, glossary_path: Path) -> Optional[GlossaryMatcher]:
+    glossary_dict = _parse_glossary(io.BytesIO(content), glossary_path)
+    return GlossaryMatcher(glossary_dict) if glossary_dict else None
+
+async def load_glossary_matcher(glossary_path: Path | None) -> Optional[GlossaryMatcher]:
+    """
+    Returns a GlossaryMatcher for the glossary file. Every upload is stored under a new path, so
+    matchers are cached by the file's content: tasks that share a glossary parse it only once.
+    """
+    if not glossary_path:
+        return None
+    content = await asyncio.to_thread(_read_glossary_file, glossary_path)
+    if content is None:
+        return None
+    cache_key = hashlib.blake2b(content, digest_size=16).digest()
+    matcher = _glossary_matchers.get(cache_key)
+    if matcher is None:
+        matcher = await asyncio.to_thread(_build_glossary_matcher, content, glossary_path)
+        if matcher is None:
+            return None
+        _glossary_matchers[cache_key] = matcher
+        if len(_glossary_matchers) > GLOSSARY_CACHE_SIZE:
+            _glossary_matchers.popitem(last=False)
+    _glossary_matchers.move_to_end(cache_key)
+    return matcher
+
+async def _finish_in_thread(func: Callable[[], None]):
+    """
+    Runs `func` in a worker thread. If the caller is cancelled meanwhile, the cancellation is only
+    raised once the thread is done: a thread can't be stopped, and a write that finishes after
+    its task has ended could recreate a file that deleting the task has just removed.
+    """
+    thread_call = asyncio.ensure_future(asyncio.to_thread(func))
+    try:
+        await asyncio.shield(thread_call)
+    except asyncio.CancelledError:
+        await asyncio.wait({thread_call})
+        raise
+
 async def process_csv(
     csv_path: Path,
     ollama_host: str,
     model: str,
     batch_size: int,
     progress_callback: ProgressCallback = None,
-    glossary_path: Path | None = None
+    glossary_path: Path | None = None,
+    source_lang: str | None = None,
+    target_lang: str | None = None,
+    overwrite: bool = False
 ):
     """
     Core logic for CSV translation. Languages are determined by the CSV headers.
     Progress is reported via a callback. CancelledError will be propagated to the caller.
+
+    By default the first column is the source and every other column a target; only empty
+    cells are translated. `source_lang` and `target_lang` pick (or, for the target, add)
+    specific columns instead, and `overwrite` re-translates cells that already have a value.
     """
-    glossary_dict = load_glossary(glossary_path)
+    # Parsing and writing files is blocking pandas work; it runs in worker threads so the
+    # event loop keeps serving requests and WebSocket updates meanwhile.
+    # The term matcher is built once per glossary instead of once per translated text.
+    glossary_matcher = await load_glossary_matcher(glossary_path)
 
     try:
-        df = pd.read_csv(csv_path, dtype=str, encoding='utf-8-sig').fillna('')
+        df = await asyncio.to_thread(_read_csv, csv_path)
     except Exception as e:
         print(f"Error reading CSV {csv_path}: {e}")
         raise
 
+    if source_lang is not None and source_lang not in df.columns:
+        raise ValueError(f"Source language column '{source_lang}' not found in the CSV.")
+    if target_lang is not None and target_lang not in df.columns:
+        df[target_lang] = ''
+
     if len(df.columns) < 2:
         raise ValueError("CSV file must contain at least two columns: one for the source language and at least one for a target language.")
 
@@ -65,62 +161,150 @@ async def process_csv(
                 "This seems to be an IDML-extracted file. Please use BCP-47 language codes (e.g., 'en', 'de') as headers for the CSV Translator."
             )
 
-    source_lang = df.columns[0]
-    target_langs = df.columns[1:]
+    if source_lang is None:
+        source_lang = df.columns[0]
+    if target_lang is not None:
+        target_langs = [target_lang]
+    else:
+        target_langs = [column for column in df.columns if column != source_lang]
     source_col_name = source_lang
 
-    client = ollama.AsyncClient(host=ollama_host)
-    
-    # Calculate total number of cells to translate for progress tracking
+    client = get_client(ollama_host)
+
+    processed_count = 0
+    processed_filepath = csv_path.with_name(f"{csv_path.stem}_processed.csv")
+
+    # --- Collect the work for every target language up front ---
+    # Repeated source strings (very common in IDML-extracted files) only need one LLM call,
+    # so the row indices are grouped by their source text and each unique text is translated once.
+    # The selection runs on the underlying NumPy arrays, and the source column is only checked once.
+    source_texts = df[source_col_name].to_numpy()
+    has_source = source_texts != ''
+    indices_by_text: Dict[str, Dict[str, list]] = {}
+    # Total number of cells to translate, for progress tracking
     total_to_translate = 0
     for target_lang in target_langs:
-        if target_lang not in df.columns:
-            df[target_lang] = ''
-        total_to_translate += int((df[target_lang] == '').sum())
+        # Identify rows that need translation for the current target language
+        positions = np.flatnonzero(has_source if overwrite else has_source & (df[target_lang].to_numpy() == ''))
+        total_to_translate += len(positions)
+
+        lang_indices: Dict[str, list] = {}
+        for position, text in zip(positions.tolist(), source_texts[positions].tolist()):
+            lang_indices.setdefault(text, []).append(position)
+        if lang_indices:
+            indices_by_text[target_lang] = lang_indices
+
+    # Translations are stored by row position in plain arrays, one per target language, instead of
+    # going through pandas' label-based `.loc` for every result; they're put into `df` when it's written
+    target_columns = {target_lang: df[target_lang].to_numpy(dtype=object, copy=True) for target_lang in indices_by_text}
 
     if progress_callback:
         await progress_callback(0, total_to_translate)
 
-    processed_count = 0
-    processed_filepath = csv_path.with_name(f"{csv_path.stem}_processed.csv")
+    # --- Bounded translation pipeline ---
+    # Instead of waiting for the slowest request of every batch, keep up to OLLAMA_NUM_PARALLEL
+    # requests in flight at all times and store each translation as soon as it completes.
+    # The limit is per task; concurrent tasks each have their own.
+    # With TEXTS_PER_REQUEST above 1, short texts are sent to the model several at a time.
+    settings = get_settings()
+    semaphore = asyncio.Semaphore(settings.ollama_num_parallel)
 
-    for target_lang in target_langs:
-        target_col_name = target_lang
-        
-        # Ensure target column exists
-        if target_col_name not in df.columns:
-            df[target_col_name] = ''
+    async def translate_group(target_lang: str, texts: list):
+        async with semaphore:
+            if len(texts) == 1:
+                translated = [await translate_text(client, texts[0], source_lang, target_lang, model, glossary=glossary_matcher)]
+            else:
+                translated = await translate_batch(client, texts, source_lang, target_lang, model, glossary=glossary_matcher)
+            return target_lang, texts, translated
 
-        # Identify rows that need translation for the current target language
-        rows_to_process_mask = (df[target_col_name] == '') & (df[source_col_name] != '')
-        indices_to_update = df.index[rows_to_process_mask]
-        texts_to_translate = df.loc[indices_to_update, source_col_name].tolist()
-
-        if not texts_to_translate:
-            continue
-
-        for i in range(0, len(texts_to_translate), batch_size):
-            batch_texts = texts_to_translate[i:i + batch_size]
-            batch_indices = indices_to_update[i:i + batch_size]
-            
-            tasks = [
-                translate_text(client, text, source_lang, target_lang, model, glossary=glossary_dict)
-                for text in batch_texts
-            ]
-            
-            batch_results = await asyncio.gather(*tasks)
-            
-            df.loc[batch_indices, target_col_name] = batch_results
-            processed_count += len(batch_results)
-
-            try:
-                df.to_csv(processed_filepath, index=False, encoding='utf-8-sig')
-                if progress_callback:
-                    await progress_callback(processed_count, total_to_translate)
-            except Exception as e:
-                print(f"Error writing to CSV file {processed_filepath}: {e}")
-                raise
-    
-    # Final save to ensure the file exists even if no translations were needed
-    if not processed_filepath.exists():
-        df.to_csv(processed_filepath, index=False, encoding='utf-8-sig')
\ No newline at end of file
+    def write_processed_file():
+        # Write next to the target and swap it in, so a crash never leaves a half-written checkpoint
+        temp_filepath = processed_filepath.with_name(f"{processed_filepath.name}.tmp")
+        for target_lang, column in target_columns.items():
+            df[target_lang] = column
+        try:
+            df.to_csv(temp_filepath, index=False, encoding='utf-8-sig')
+            os.replace(temp_filepath, processed_filepath)
+        except Exception as e:
+            print(f"Error writing to CSV file {processed_filepath}: {e}")
+            raise
+
+    last_write = last_progress = time.monotonic()
+    checkpoint_interval = CHECKPOINT_INTERVAL_SECONDS
+
+    async def save_checkpoint(force: bool = False):
+        # Rewriting the whole file and reporting progress are both rate-limited, so large files
+        # aren't re-serialized after every batch. The loop below keeps translating meanwhile, but
+        # holds back new results until this is done, so the thread can serialize `df` safely.
+        nonlocal last_write, last_progress, checkpoint_interval
+        if force or time.monotonic() - last_write >= checkpoint_interval:
+            write_started = time.monotonic()
+            await _finish_in_thread(write_processed_file)
+            last_write = time.monotonic()
+            checkpoint_interval = max(CHECKPOINT_INTERVAL_SECONDS, (last_write - write_started) / CHECKPOINT_MAX_TIME_SHARE)
+        if progress_callback and (force or time.monotonic() - last_progress >= PROGRESS_INTERVAL_SECONDS):
+            await progress_callback(processed_count, total_to_translate)
+            last_progress = time.monotonic()
+
+    group_size = settings.texts_per_request
+
+    def iter_groups():
+        for target_lang, lang_indices in indices_by_text.items():
+            unique_texts = list(lang_indices)
+            for start in range(0, len(unique_texts), group_size):
+                yield target_lang, unique_texts[start:start + group_size]
+
+    # Groups become tasks only as room frees up in a sliding window, so a file with hundreds of
+    # thousands of texts doesn't create a task for every one of them up front
+    window_size = PIPELINE_WINDOW_FACTOR * settings.ollama_num_parallel
+    groups = iter_groups()
+    in_flight = set()
+    # A running checkpoint write. The window keeps being refilled while it runs, so Ollama never
+    # waits for the disk; results that complete meanwhile are kept in `held_back` until it's done.
+    checkpoint = None
+    held_back = []
+    completed_since_save = 0
+    try:
+        while True:
+            for target_lang, texts in itertools.islice(groups, window_size - len(in_flight)):
+                in_flight.add(asyncio.create_task(translate_group(target_lang, texts)))
+            if not in_flight and checkpoint is None:
+                break
+            done, _ = await asyncio.wait(in_flight | {checkpoint} if checkpoint else in_flight, return_when=asyncio.FIRST_COMPLETED)
+            if checkpoint in done:
+                done.discard(checkpoint)
+                # Raises if the write failed
+                checkpoint.result()
+                checkpoint = None
+            in_flight -= done
+            held_back.extend(done)
+            if checkpoint is not None:
+                continue
+
+            for completed in held_back:
+                target_lang, texts, translations = completed.result()
+                for text, translated in zip(texts, translations):
+                    rows = indices_by_text[target_lang][text]
+                    target_columns[target_lang][rows] = translated
+                    processed_count += len(rows)
+                completed_since_save += len(texts)
+            held_back.clear()
+
+            # Persist and report progress every `batch_size` completed translations
+            if completed_since_save >= batch_size:
+                completed_since_save = 0
+                checkpoint = asyncio.create_task(save_checkpoint())
+    finally:
+        # Make sure no request keeps running if we were cancelled or hit an error
+        for task in in_flight:
+            task.cancel()
+        if checkpoint is not None:
+            # The write can't be stopped; it ends once its thread is done (see `_finish_in_thread`)
+            checkpoint.cancel()
+            await asyncio.wait({checkpoint})
+
+    # Final save; also makes sure the file exists even if no translations were needed
+    if indices_by_text:
+        await save_checkpoint(force=True)
+    else:
+        await _finish_in_thread(write_processed_file)
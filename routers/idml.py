@@ -1,9 +1,17 @@
 # routers/idml.py
+import asyncio
+import os
+import time
+import uuid
 from pathlib import Path
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Response
+from typing import Callable
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi.responses import FileResponse
 
 from dependencies import verify_api_token
-from idml_processor import extract_idml_to_csv, rebuild_idml_from_csv
+from idml_processor import extract_idml_to_csv_file, rebuild_idml_to_file
+from settings import get_settings
+from upload_utils import hash_upload_file, upload_slot, upload_source
 
 # --- Router Setup ---
 router = APIRouter(
@@ -12,49 +20,99 @@ router = APIRouter(
 )
 
 UPLOAD_DIR = Path("uploads")
+# Results are stored under the SHA-256 of their inputs, so repeated uploads skip the work entirely
+CACHE_DIR = UPLOAD_DIR / "cache"
+CSV_MEDIA_TYPE = "text/csv; charset=utf-8-sig"
+IDML_MEDIA_TYPE = "application/vnd.adobe.indesign-idml-package"
+# Results used this recently are never evicted, so a response that is about to send one can't lose it
+CACHE_EVICTION_GRACE_SECONDS = 60
 
-@router.post("/extract", dependencies=[Depends(verify_api_token)])
+def _write_cache_entry(cache_path: Path, write_output: Callable[[Path], None]):
+    """
+    Lets `write_output` produce a result file and moves it into the cache,
+    so readers never see a partial file. The result is never held in memory.
+    """
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    # Unique per request, as the same inputs may be processed concurrently
+    temp_path = cache_path.with_name(f"{cache_path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        write_output(temp_path)
+        os.replace(temp_path, cache_path)
+    finally:
+        temp_path.unlink(missing_ok=True)
+
+def _evict_cache_entries(max_bytes: int, grace_seconds: float = CACHE_EVICTION_GRACE_SECONDS):
+    """
+    Removes the least recently used results until the cache fits into IDML_CACHE_MB.
+    Results used within the last `grace_seconds` are kept, as they may be about to be sent;
+    until they age out, the cache can exceed its limit.
+    """
+    entries = []
+    for path in CACHE_DIR.iterdir():
+        if path.suffix == ".tmp":
+            continue
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    cutoff = time.time() - grace_seconds
+    for mtime, size, path in sorted(entries, key=lambda entry: entry[0]):
+        if total <= max_bytes or mtime > cutoff:
+            break
+        try:
+            path.unlink(missing_ok=True)
+        except OSError as e:
+            print(f"Error removing cached IDML result {path}: {e}")
+            continue
+        total -= size
+
+def _ensure_cache_entry(cache_path: Path, write_output: Callable[[Path], None]):
+    """
+    Makes sure the result is cached, producing it first if it isn't. Either way the entry
+    was just written or touched, so an eviction won't remove it while it is being sent.
+    """
+    try:
+        # A hit counts as a use: it keeps the entry from being evicted or swept as stale
+        os.utime(cache_path)
+    except FileNotFoundError:
+        _write_cache_entry(cache_path, write_output)
+        _evict_cache_entries(get_settings().idml_cache_max_bytes)
+
+@router.post("/extract", dependencies=[Depends(verify_api_token), Depends(upload_slot)])
 async def handle_idml_extraction(idml_file: UploadFile = File(...)):
-    # Use a more unique temporary filename to avoid potential collisions
-    temp_idml_path = UPLOAD_DIR / f"temp_extract_{Path(idml_file.filename).name}"
     try:
-        with open(temp_idml_path, "wb") as buffer:
-            buffer.write(await idml_file.read())
-        
-        csv_content = extract_idml_to_csv(temp_idml_path)
-        
-        # --- NEW: Ensure BOM for Excel compatibility --
-        encoded_content = csv_content.encode('utf-8-sig')
+        # The spooled upload is read in place; it is never copied to another file or into memory
+        idml_digest = await hash_upload_file(idml_file, get_settings().max_idml_upload_bytes)
 
         output_filename = f"{Path(idml_file.filename).stem}.csv"
         headers = {'Content-Disposition': f'attachment; filename="{output_filename}"'}
-        return Response(content=encoded_content, media_type="text/csv; charset=utf-8-sig", headers=headers)
+
+        # The CSV is written straight into the cache (with a BOM for Excel) and streamed from there.
+        # Parsing and writing the package is blocking work; keep it (and the cache lookup) off the event loop
+        cache_path = CACHE_DIR / f"{idml_digest}.csv"
+        await asyncio.to_thread(_ensure_cache_entry, cache_path, lambda output_path: extract_idml_to_csv_file(upload_source(idml_file), output_path))
+
+        return FileResponse(cache_path, media_type=CSV_MEDIA_TYPE, headers=headers)
 
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        if temp_idml_path.exists():
-            temp_idml_path.unlink()
 
-@router.post("/rebuild", dependencies=[Depends(verify_api_token)])
+@router.post("/rebuild", dependencies=[Depends(verify_api_token), Depends(upload_slot)])
 async def handle_idml_rebuild(original_idml: UploadFile = File(...), translated_csv: UploadFile = File(...)):
-    temp_idml_path = UPLOAD_DIR / f"temp_rebuild_{Path(original_idml.filename).name}"
-    temp_csv_path = UPLOAD_DIR / f"temp_rebuild_{Path(translated_csv.filename).name}"
-    
     try:
-        with open(temp_idml_path, "wb") as buffer:
-            buffer.write(await original_idml.read())
-        with open(temp_csv_path, "wb") as buffer:
-            buffer.write(await translated_csv.read())
-            
-        rebuilt_idml_content = rebuild_idml_from_csv(temp_idml_path, temp_csv_path)
-        
+        max_bytes = get_settings().max_idml_upload_bytes
+        idml_digest = await hash_upload_file(original_idml, max_bytes)
+        csv_digest = await hash_upload_file(translated_csv, max_bytes)
+
         output_filename = f"{Path(original_idml.filename).stem}_translated.idml"
         headers = {'Content-Disposition': f'attachment; filename="{output_filename}"'}
-        return Response(content=rebuilt_idml_content, media_type="application/vnd.adobe.indesign-idml-package", headers=headers)
-        
+
+        cache_path = CACHE_DIR / f"{idml_digest}_{csv_digest}.idml"
+        await asyncio.to_thread(_ensure_cache_entry, cache_path, lambda output_path: rebuild_idml_to_file(upload_source(original_idml), upload_source(translated_csv), output_path))
+
+        return FileResponse(cache_path, media_type=IDML_MEDIA_TYPE, headers=headers)
+
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        if temp_idml_path.exists(): temp_idml_path.unlink()
-        if temp_csv_path.exists(): temp_csv_path.unlink()
@@ -1,21 +1,16 @@
 # routers/translator.py
-import os
-import ollama
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 
 from dependencies import verify_api_token
-from translator import translate_text
+from settings import Settings, get_settings
+from translator import translate_text, get_client
 
 # --- Router Setup ---
 router = APIRouter(
     tags=["Live Translation"],
 )
 
-# --- Environment & Constants ---
-OLLAMA_HOST = os.getenv("OLLAMA_HOST")
-OLLAMA_MODEL = os.getenv("OLLAMA_MODEL")
-
 # --- Data Models ---
 class LiveTranslateRequest(BaseModel):
     text: str
@@ -24,20 +19,20 @@ class LiveTranslateRequest(BaseModel):
 
 # --- Endpoint ---
 @router.post("/live_translate", dependencies=[Depends(verify_api_token)])
-async def live_translate(request: LiveTranslateRequest):
-    if not OLLAMA_HOST or not OLLAMA_MODEL:
+async def live_translate(request: LiveTranslateRequest, settings: Settings = Depends(get_settings)):
+    if not settings.ollama_host or not settings.ollama_model:
         raise HTTPException(
             status_code=500, 
             detail="Ollama host or model is not configured on the server."
         )
     try:
-        client = ollama.AsyncClient(host=OLLAMA_HOST)
+        client = get_client(settings.ollama_host)
         translated = await translate_text(
             client=client,
             text_to_translate=request.text,
             source_lang=request.source_lang,
             target_lang=request.target_lang,
-            model=OLLAMA_MODEL,
+            model=settings.ollama_model,
         )
         return {"translated_text": translated}
     except Exception as e:
@@ -1,18 +1,23 @@
 # routers/tasks.py
-import uuid
+import asyncio
 import os
+import secrets
+import uuid
 from pathlib import Path
 from urllib.parse import quote
 
+import orjson
 from fastapi import (
-    APIRouter, Depends, HTTPException, UploadFile, File, Form
+    APIRouter, Depends, HTTPException, Request, UploadFile, File, Form
 )
-from fastapi.responses import FileResponse, JSONResponse
-from starlette.status import HTTP_403_FORBIDDEN, HTTP_404_NOT_FOUND
-
-from dependencies import get_current_api_token
-from storage import read_tasks, write_tasks
-from worker import get_running_tasks_dict
+from fastapi.responses import FileResponse, JSONResponse, Response
+from starlette.status import HTTP_304_NOT_MODIFIED, HTTP_403_FORBIDDEN, HTTP_404_NOT_FOUND
+
+from dependencies import get_current_api_token, token_digest
+from settings import Settings, get_settings
+from storage import read_tasks, get_task, add_task, update_task, remove_task, client_view, tasks_version
+from upload_utils import hash_upload_file, save_upload_file, task_upload_dir, upload_slot
+from worker import enqueue_task, get_running_tasks_dict
 # Import the WebSocket manager from the ws router to notify it of changes
 from routers.ws import manager as ws_manager
 
@@ -24,70 +29,160 @@ router = APIRouter(
 
 # --- Constants ---
 UPLOAD_DIR = Path("uploads")
-OLLAMA_HOST = os.getenv("OLLAMA_HOST")
-OLLAMA_MODEL = os.getenv("OLLAMA_MODEL")
+ALLOWED_UPLOAD_EXTENSIONS = frozenset({".csv"})
+# Plain ASCII name for old clients, plus the exact UTF-8 name (RFC 6266) for everyone else
+CONTENT_DISPOSITION_TEMPLATE = "attachment; filename=\"{ascii_filename}\"; filename*=UTF-8''{utf8_filename}"
+# Statuses of tasks that an identical re-upload is answered with, instead of translating it again.
+# Finished tasks are never reused: a run during an Ollama outage "completes" with untranslated
+# texts, and uploading the same file again is how it gets retried.
+REUSABLE_TASK_STATUSES = frozenset({"uploading", "pending", "running"})
+# Part of the task list ETag; the task version counter starts over on every restart, so
+# without it a client could get a 304 for an entirely different task list
+_BOOT_ID = secrets.token_hex(8)
+# File cleanups still running after their DELETE request returned; the event loop only keeps
+# weak references to tasks, so they're held here until done
+_pending_cleanups: set[asyncio.Task] = set()
+
+def _find_identical_task(api_token: str, content_digest: str, glossary_digest: str | None, model: str | None) -> dict | None:
+    """Returns the caller's task for the same file, glossary and model, if it is still queued or running."""
+    for task in read_tasks():
+        if (
+            task.get("api_token") == api_token
+            and task.get("content_sha256") == content_digest
+            and task.get("glossary_sha256") == glossary_digest
+            and task.get("model") == model
+            and task["status"] in REUSABLE_TASK_STATUSES
+        ):
+            return task
+    return None
+
+def _processed_path(task: dict) -> Path:
+    """Returns where the worker writes the task's translated file."""
+    if task.get("processed_path"):
+        return Path(task["processed_path"])
+    # Tasks created before the path was stored with the task
+    original_filepath = Path(task["filepath"])
+    suffix = ".idml" if task.get("file_type") == "idml" and task["status"] == "completed" else ".csv"
+    return original_filepath.with_name(f"{original_filepath.stem}_processed{suffix}")
+
+def _file_response(path: Path, filename: str) -> FileResponse:
+    stem, suffix = os.path.splitext(filename)
+    content_disposition = CONTENT_DISPOSITION_TEMPLATE.format(
+        ascii_filename=stem.encode('ascii', 'ignore').decode('ascii') + suffix,
+        utf8_filename=quote(filename),
+    )
+    return FileResponse(path, media_type="application/octet-stream", headers={"Content-Disposition": content_disposition})
+
+async def _delete_files(paths: list[Path], after: asyncio.Task | None = None):
+    if after is not None:
+        # A cancelled task may still be finishing a checkpoint write; deleting first would let it recreate the file
+        await asyncio.wait({after})
+    # The unlinks overlap, as they are network round trips on NFS
+    await asyncio.gather(*(asyncio.to_thread(_delete_file, path) for path in paths))
+
+def _delete_file(path: Path):
+    # A single unlink per file; most intermediate files usually don't exist
+    try:
+        path.unlink()
+        print(f"Deleted file: {path}")
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"Error deleting file {path}: {e}")
 
 # --- Endpoints ---
 
 @router.get("/")
-async def get_tasks(api_token: str = Depends(get_current_api_token)):
+async def get_tasks(request: Request, api_token: str = Depends(get_current_api_token)):
     """Get the list of all tasks and indicate ownership."""
-    all_tasks = read_tasks()
-    for task in all_tasks:
-        task["is_owner"] = task.get("api_token") == api_token
-    return all_tasks
+    # The response depends on the task list and, through `is_owner`, on the token
+    etag = f'W/"{_BOOT_ID}-{tasks_version()}-{token_digest(api_token).hex()[:16]}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    all_tasks = [client_view(task, api_token) for task in read_tasks()]
+    # The tasks are plain JSON data already, so skip FastAPI's encoder and serialize with orjson
+    return Response(content=orjson.dumps(all_tasks), media_type="application/json", headers={"ETag": etag})
 
-@router.post("/upload")
+@router.post("/upload", dependencies=[Depends(upload_slot)])
 async def handle_upload(
     upload_file: UploadFile = File(...),
     glossary_file: UploadFile | None = File(None),
     note: str = Form(""),
-    api_token: str = Depends(get_current_api_token)
+    api_token: str = Depends(get_current_api_token),
+    settings: Settings = Depends(get_settings)
 ):
     """Handles file upload and creates a new translation task."""
     original_filename = upload_file.filename
     file_extension = Path(original_filename).suffix.lower()
 
-    if file_extension not in [".csv"]:
+    if file_extension not in ALLOWED_UPLOAD_EXTENSIONS:
         raise HTTPException(status_code=400, detail="Invalid file type. Only .csv files are accepted.")
 
-    task_id = str(uuid.uuid4())
-    filepath = UPLOAD_DIR / f"{task_id}_{original_filename}"
-    with open(filepath, "wb") as buffer:
-        buffer.write(await upload_file.read())
+    has_glossary = bool(glossary_file and glossary_file.filename)
+
+    # Hash the spooled uploads first, so a repeated upload is recognized before anything is written
+    content_digest = await hash_upload_file(upload_file, settings.max_upload_bytes)
+    glossary_digest = await hash_upload_file(glossary_file, settings.max_upload_bytes) if has_glossary else None
+    existing_task = _find_identical_task(api_token, content_digest, glossary_digest, settings.ollama_model)
+    if existing_task:
+        status = existing_task["status"]
+        return JSONResponse({
+            "message": f"An identical task ('{existing_task['filename']}') is already {status}, so no new task was added. Its note and file name are kept.",
+            "task_id": existing_task["id"],
+            "existing_status": status,
+        })
 
-    glossary_filepath_str = None
-    if glossary_file and glossary_file.filename:
-        glossary_filepath = UPLOAD_DIR / f"{task_id}_glossary_{glossary_file.filename}"
-        with open(glossary_filepath, "wb") as buffer:
-            buffer.write(await glossary_file.read())
-        glossary_filepath_str = str(glossary_filepath)
+    task_id = str(uuid.uuid4())
+    task_dir = task_upload_dir(UPLOAD_DIR, task_id)
+    filepath = task_dir / f"{task_id}_{original_filename}"
+    # Must match the name `process_csv` writes its output to
+    processed_filepath = filepath.with_name(f"{filepath.stem}_processed.csv")
+    glossary_filepath = task_dir / f"{task_id}_glossary_{glossary_file.filename}" if has_glossary else None
 
     new_task = {
         "id": task_id,
         "filename": original_filename,
         "filepath": str(filepath),
+        "processed_path": str(processed_filepath),
+        "download_stem": Path(original_filename).stem,
         "file_type": "csv",
-        "status": "pending",
+        # Becomes "pending" once the files are saved; the worker drops tasks still "uploading" at startup
+        "status": "uploading",
         "progress": {"processed": 0, "total": 0},
-        "glossary_path": glossary_filepath_str,
+        "glossary_path": str(glossary_filepath) if glossary_filepath else None,
         "note": note,
-        "ollama_host": OLLAMA_HOST,
-        "model": OLLAMA_MODEL,
+        "ollama_host": settings.ollama_host,
+        "model": settings.ollama_model,
         "batch_size": 10,
-        "api_token": api_token  # Associate task with the user's token
+        "api_token": api_token,  # Associate task with the user's token
+        "content_sha256": content_digest,
+        "glossary_sha256": glossary_digest,
     }
-    tasks = read_tasks()
-    tasks.append(new_task)
-    write_tasks(tasks)
+    # Added right after the lookup, with no await in between, so a concurrent identical upload
+    # finds this task instead of adding a second one. The worker only gets it once the files are saved.
+    add_task(new_task)
+    try:
+        await save_upload_file(upload_file, filepath)
+        if glossary_filepath:
+            await save_upload_file(glossary_file, glossary_filepath)
+    except BaseException:
+        remove_task(task_id)
+        # Don't leave a partially written upload behind until the upload GC gets to it
+        await _delete_files([path for path in (filepath, glossary_filepath) if path])
+        raise
+    if not update_task(task_id, {"status": "pending"}):
+        # Deleted while its files were being saved; the delete ran before they existed
+        await _delete_files([path for path in (filepath, glossary_filepath) if path])
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="The task was deleted during the upload.")
+    enqueue_task(task_id)
     await ws_manager.broadcast_tasks()
-    return JSONResponse({"message": "Task added to queue"})
+    return JSONResponse({"message": "Task added to queue", "task_id": task_id})
 
 @router.delete("/{task_id}")
 async def delete_task(task_id: str, api_token: str = Depends(get_current_api_token)):
     """Deletes a task and its associated files."""
-    tasks = read_tasks()
-    task_to_delete = next((t for t in tasks if t["id"] == task_id), None)
+    task_to_delete = get_task(task_id)
 
     if not task_to_delete:
         raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Task not found")
@@ -96,13 +191,12 @@ async def delete_task(task_id: str, api_token: str = Depends(get_current_api_tok
     if task_to_delete.get("api_token") != api_token:
         raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail="You do not have permission to delete this task.")
 
-    running_tasks = get_running_tasks_dict()
-    if task_id in running_tasks:
+    running_task = get_running_tasks_dict().get(task_id)
+    if running_task is not None:
         print(f"Cancelling running task {task_id} via API delete...")
-        running_tasks[task_id].cancel()
+        running_task.cancel()
 
-    remaining_tasks = [t for t in tasks if t["id"] != task_id]
-    write_tasks(remaining_tasks)
+    remove_task(task_id)
 
     # --- Robust File Cleanup ---
     try:
@@ -119,27 +213,20 @@ async def delete_task(task_id: str, api_token: str = Depends(get_current_api_tok
         file_type = task_to_delete.get("file_type", "csv")
         
         if file_type == 'idml':
-            # 3. Final processed IDML
-            files_to_delete.append(original_filepath.with_name(f"{original_filepath.stem}_processed.idml"))
-            
-            # 4. Intermediate temporary files for IDML process
-            # Note: These names must match the ones created in `processor.py`
-            temp_csv_path = original_filepath.with_name(f"{original_filepath.stem}.csv")
-            translated_temp_csv_path = temp_csv_path.with_name(f"{temp_csv_path.stem}_processed.csv")
-            files_to_delete.append(temp_csv_path)
-            files_to_delete.append(translated_temp_csv_path)
+            # 3. Final processed IDML and 4. the intermediate CSVs of the IDML process, all next
+            #    to the upload (only tasks from older versions have these)
+            stem, parent = original_filepath.stem, original_filepath.parent
+            files_to_delete.extend(parent / name for name in (f"{stem}_processed.idml", f"{stem}.csv", f"{stem}_processed.csv"))
         else: # csv
             # 3. Final processed CSV
-            files_to_delete.append(original_filepath.with_name(f"{original_filepath.stem}_processed.csv"))
+            files_to_delete.append(_processed_path(task_to_delete))
 
-        # 5. Perform deletion
-        for path in files_to_delete:
-            if path and path.exists():
-                try:
-                    path.unlink()
-                    print(f"Deleted file: {path}")
-                except OSError as e:
-                    print(f"Error deleting file {path}: {e}")
+        # 5. Delete in the background, off the event loop, once a cancelled run has stopped writing;
+        #    the task is already gone, so the response doesn't have to wait.
+        #    Files left behind by a shutdown are removed by the upload GC.
+        cleanup = asyncio.create_task(_delete_files(files_to_delete, after=running_task))
+        _pending_cleanups.add(cleanup)
+        cleanup.add_done_callback(_pending_cleanups.discard)
 
     except Exception as e:
         print(f"An unexpected error occurred during file cleanup for task {task_id}: {e}")
@@ -150,7 +237,7 @@ async def delete_task(task_id: str, api_token: str = Depends(get_current_api_tok
 @router.get("/download/{task_id}")
 async def download_file(task_id: str, api_token: str = Depends(get_current_api_token)):
     """Downloads the output file for a given task."""
-    task = next((t for t in read_tasks() if t["id"] == task_id), None)
+    task = get_task(task_id)
     if not task:
         raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Task not found")
 
@@ -158,41 +245,16 @@ async def download_file(task_id: str, api_token: str = Depends(get_current_api_t
     if task.get("api_token") != api_token:
         raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail="You do not have permission to download this file.")
 
-    original_filepath = Path(task["filepath"])
-    original_stem = Path(task['filename']).stem
-    file_type = task.get("file_type", "csv")
-
-    final_idml = original_filepath.with_name(f"{original_filepath.stem}_processed.idml")
-    final_csv = original_filepath.with_name(f"{original_filepath.stem}_processed.csv")
-
-    def create_file_response(path, filename):
-        ascii_filename = Path(filename).stem.encode('ascii', 'ignore').decode('ascii') + Path(filename).suffix
-        utf8_filename = quote(filename)
-        headers = {
-            "Content-Disposition": f"attachment; filename=\"{ascii_filename}\"; filename*=UTF-8''{utf8_filename}"
-        }
-        return FileResponse(path, media_type="application/octet-stream", headers=headers)
-
-    # Handle CSV file download
-    if file_type == 'csv' and final_csv.exists():
-        if task["status"] == "completed":
-            filename = f"{original_stem}_translated.csv"
-        else:
-            filename = f"{original_stem}_inprogress.csv"
-        return create_file_response(final_csv, filename)
-
-    # Handle IDML file download (for completed tasks)
-    if task["status"] == "completed" and file_type == 'idml' and final_idml.exists():
-        filename = f"{original_stem}_translated.idml"
-        return create_file_response(final_idml, filename)
-
-    # Handle in-progress IDML download (which serves the intermediate CSV)
-    if task["status"] != "completed" and file_type == 'idml' and final_csv.exists():
-        filename = f"{original_stem}_inprogress.csv"
-        return create_file_response(final_csv, filename)
+    # The processed file is the final output once the task is completed, a checkpoint before that
+    processed_path = _processed_path(task)
+    if processed_path.exists():
+        download_stem = task.get("download_stem") or Path(task["filename"]).stem
+        state = "translated" if task["status"] == "completed" else "inprogress"
+        return _file_response(processed_path, f"{download_stem}_{state}{processed_path.suffix}")
 
     # Fallback to original file if no processed file is found
+    original_filepath = Path(task["filepath"])
     if original_filepath.exists():
-        return create_file_response(original_filepath, task["filename"])
+        return _file_response(original_filepath, task["filename"])
 
     raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="No downloadable file found for this task.")
\ No newline at end of file
@@ -1,66 +1,124 @@
 # routers/ws.py
-from typing import List, Tuple
+import asyncio
+import orjson
+from typing import Any, Dict, List, Optional, Tuple
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 
-from storage import read_tasks
-from token_manager import get_tokens
+from dependencies import get_valid_token_digests, token_digest
+from storage import read_tasks, client_view
+
+# Task-list updates are sent to the clients at most this often; changes in between are coalesced
+BROADCAST_INTERVAL_SECONDS = 0.2
 
 class ConnectionManager:
     def __init__(self):
-        # Store tuples of (websocket, api_token)
-        self.active_connections: List[Tuple[WebSocket, str]] = []
+        # Maps each websocket to its api_token, so connecting and disconnecting are O(1)
+        self.active_connections: Dict[WebSocket, str] = {}
+        self._broadcast_pending = False
+        # Per-task field updates waiting to be sent, merged until the next round
+        self._pending_patches: Dict[str, Dict[str, Any]] = {}
+        self._broadcast_task: Optional[asyncio.Task] = None
 
     async def connect(self, websocket: WebSocket, token: str):
         await websocket.accept()
-        self.active_connections.append((websocket, token))
+        self.active_connections[websocket] = token
 
     def disconnect(self, websocket: WebSocket):
-        connection_to_remove = next((conn for conn in self.active_connections if conn[0] == websocket), None)
-        if connection_to_remove:
-            self.active_connections.remove(connection_to_remove)
+        self.active_connections.pop(websocket, None)
+
+    @staticmethod
+    def _encode_tasks_update(tasks: List[Dict], token: str) -> str:
+        # Create a personalized list of tasks with ownership info
+        message = {"type": "tasks_update", "payload": [client_view(task, token) for task in tasks]}
+        # Same text frame as send_json, but encoded with orjson
+        return orjson.dumps(message).decode()
 
     async def send_tasks_to_connection(self, connection: Tuple[WebSocket, str]):
         websocket, token = connection
-        all_tasks = read_tasks()
-        
-        # Create a personalized list of tasks with ownership info
-        tasks_with_ownership = []
-        for task in all_tasks:
-            task_copy = task.copy()
-            task_copy["is_owner"] = task_copy.get("api_token") == token
-            tasks_with_ownership.append(task_copy)
+        await self.send_messages_to_connection(websocket, [self._encode_tasks_update(read_tasks(), token)])
 
-        message = {"type": "tasks_update", "payload": tasks_with_ownership}
+    async def send_messages_to_connection(self, websocket: WebSocket, messages: List[str]):
+        # Sent one after another, so a client always receives its messages in order
         try:
-            await websocket.send_json(message)
+            for message in messages:
+                await websocket.send_text(message)
         except (WebSocketDisconnect, RuntimeError):
             self.disconnect(websocket)
 
     async def broadcast_tasks(self):
-        if not self.active_connections:
-            return
-        # Create a copy for safe iteration
-        for connection in list(self.active_connections):
-            await self.send_tasks_to_connection(connection)
+        """
+        Schedules a full task-list update for all connected clients and returns immediately.
+        Updates are debounced, see `_run_broadcasts`.
+        """
+        self._broadcast_pending = True
+        self._schedule_broadcast()
+
+    async def broadcast_patch(self, task_id: str, patch: Dict[str, Any]):
+        """
+        Schedules a `task_patch` message that only carries the changed fields of one task.
+        Used for progress ticks, so their size doesn't grow with the number of queued tasks.
+        """
+        self._pending_patches.setdefault(task_id, {}).update(patch)
+        self._schedule_broadcast()
+
+    def _schedule_broadcast(self):
+        if self._broadcast_task is None:
+            self._broadcast_task = asyncio.create_task(self._run_broadcasts())
+
+    async def _run_broadcasts(self):
+        try:
+            while self._broadcast_pending or self._pending_patches:
+                send_full_update = self._broadcast_pending
+                patches, self._pending_patches = self._pending_patches, {}
+                self._broadcast_pending = False
+                # Create a copy for safe iteration; a slow client doesn't hold up the others
+                connections = list(self.active_connections.items())
+                if connections and send_full_update:
+                    # A full update is read from storage right now, so it already includes every patch.
+                    # The list only differs by ownership, so it's encoded once per token, not per client.
+                    tasks = read_tasks()
+                    messages_by_token = {}
+                    for token in {token for _, token in connections}:
+                        messages_by_token[token] = self._encode_tasks_update(tasks, token)
+                        # Encoding long lists for many users is CPU work; let requests in between
+                        await asyncio.sleep(0)
+                    sends = [self.send_messages_to_connection(websocket, [messages_by_token[token]]) for websocket, token in connections]
+                elif connections:
+                    # Patches carry no per-client fields, so each one is encoded once for everybody
+                    messages = [orjson.dumps({"type": "task_patch", "id": task_id, **patch}).decode() for task_id, patch in patches.items()]
+                    sends = [self.send_messages_to_connection(websocket, messages) for websocket, _ in connections]
+                else:
+                    sends = []
+                results = await asyncio.gather(*sends, return_exceptions=True)
+                # A client that failed in an unexpected way is dropped instead of stopping the broadcasts
+                for (websocket, _), result in zip(connections, results):
+                    if isinstance(result, Exception):
+                        print(f"Dropping WebSocket client after a failed send: {result}")
+                        self.disconnect(websocket)
+                # Everything that changes during the pause goes out together in the next round
+                await asyncio.sleep(BROADCAST_INTERVAL_SECONDS)
+        finally:
+            self._broadcast_task = None
 
 manager = ConnectionManager()
 router = APIRouter()
 
 @router.websocket("/ws/{token}")
 async def websocket_endpoint(websocket: WebSocket, token: str):
-    # --- Authenticate WebSocket connection using the token manager ---
-    valid_tokens = get_tokens()
-    if token not in valid_tokens:
+    # --- Authenticate WebSocket connection ---
+    # Same cached token set as the HTTP endpoints, so a handshake doesn't read api_tokens.json
+    if token_digest(token) not in get_valid_token_digests():
         await websocket.close(code=1008) # Policy Violation
         return
 
     await manager.connect(websocket, token)
-    # Send initial state to the newly connected client
-    await manager.send_tasks_to_connection((websocket, token))
     try:
-        while True:
-            # Keep connection alive. We are not expecting any client messages.
-            await websocket.receive_text()
-    except WebSocketDisconnect:
+        # Send initial state to the newly connected client
+        await manager.send_tasks_to_connection((websocket, token))
+        # Keep connection alive until the client leaves. We are not expecting any client
+        # messages, so incoming frames (text or binary) are dropped without being decoded.
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    finally:
         manager.disconnect(websocket)
-        print(f"Client disconnected from WebSocket.")
+    print(f"Client disconnected from WebSocket.")
@@ -0,0 +1,38 @@
+# settings.py
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+
+from dotenv import load_dotenv
+
+@dataclass(frozen=True)
+class Settings:
+    """Server configuration, read from the environment (and .env) once at startup."""
+    ollama_host: str | None
+    ollama_model: str | None
+    ollama_num_parallel: int
+    max_concurrent_uploads: int
+    worker_count: int
+    max_upload_bytes: int
+    max_idml_upload_bytes: int
+    texts_per_request: int
+    idml_cache_max_bytes: int
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """
+    Loads .env and returns the shared Settings instance.
+    Cached, so every caller and FastAPI dependency gets the same object.
+    """
+    load_dotenv()
+    return Settings(
+        ollama_host=os.getenv("OLLAMA_HOST"),
+        ollama_model=os.getenv("OLLAMA_MODEL"),
+        ollama_num_parallel=max(1, int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))),
+        max_concurrent_uploads=max(1, int(os.getenv("MAX_CONCURRENT_UPLOADS", "4"))),
+        worker_count=max(1, int(os.getenv("DINGO_WORKERS", "2"))),
+        max_upload_bytes=max(1, int(os.getenv("MAX_UPLOAD_MB", "100"))) * 1024 * 1024,
+        max_idml_upload_bytes=max(1, int(os.getenv("MAX_IDML_UPLOAD_MB", "1024"))) * 1024 * 1024,
+        texts_per_request=max(1, int(os.getenv("TEXTS_PER_REQUEST", "1"))),
+        idml_cache_max_bytes=max(0, int(os.getenv("IDML_CACHE_MB", "2048"))) * 1024 * 1024,
+    )
@@ -147,6 +147,11 @@ document.addEventListener('DOMContentLoaded', () => {
                     const errorData = await response.json();
                     throw new Error(errorData.detail || 'Upload failed');
                 }
+                const data = await response.json();
+                // An identical task is still queued or running; tell the user it was reused
+                if (data.existing_status) {
+                    alert(data.message);
+                }
                 form.reset();
             } catch (error) {
                 alert(`Upload failed: ${error.message}`);
@@ -247,6 +252,9 @@ document.addEventListener('DOMContentLoaded', () => {
             websocket.close();
         }
 
+        // Local copy of the task list; `task_patch` messages update single tasks in place
+        let currentTasks = [];
+
         function renderTasks(tasks) {
             taskListBody.innerHTML = '';
             if (!tasks || tasks.length === 0) {
@@ -336,7 +344,15 @@ document.addEventListener('DOMContentLoaded', () => {
             websocket.onmessage = (event) => {
                 const data = JSON.parse(event.data);
                 if (data.type === 'tasks_update') {
-                    renderTasks(data.payload);
+                    currentTasks = data.payload;
+                    renderTasks(currentTasks);
+                } else if (data.type === 'task_patch') {
+                    const { type, id, ...fields } = data;
+                    const task = currentTasks.find(t => t.id === id);
+                    if (task) {
+                        Object.assign(task, fields);
+                        renderTasks(currentTasks);
+                    }
                 }
             };
             websocket.onclose = (event) => {
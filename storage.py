@@ -1,23 +1,202 @@
 # storage.py
-import json
+import asyncio
+import errno
+import os
+import shutil
+import orjson
 from pathlib import Path
-from typing import List, Dict
+from typing import Any, List, Dict, Optional, Tuple
 
 TASKS_FILE = Path("tasks.json")
+# Fields that stay on the server; in particular, clients must never see each other's tokens
+PRIVATE_TASK_FIELDS = frozenset({"api_token", "content_sha256", "glossary_sha256"})
+# What renaming onto (or away from) a bind-mounted file fails with
+_UNREPLACEABLE_ERRNOS = frozenset({errno.EBUSY, errno.EXDEV})
+# Changes that don't need to hit the disk right away (progress ticks) are flushed at most this often
+TASKS_FLUSH_INTERVAL_SECONDS = 2
 
-def read_tasks() -> List[Dict]:
-    if not TASKS_FILE.exists():
-        return []
+# --- In-memory state ---
+# The tasks, keyed by id in queue order, are the source of truth. Reads never parse tasks.json;
+# once everything is flushed they stat it, to pick up changes made by others. Writes only update
+# memory before returning, and a background flush persists them to tasks.json.
+# The API stays synchronous on purpose: a read-modify-write never yields to the event loop,
+# so concurrent requests and the worker can't overwrite each other's changes.
+_tasks: Optional[Dict[str, Dict]] = None
+# (mtime_ns, size) of tasks.json as of the last load or flush, to notice changes made by others
+_cached_signature: Optional[Tuple[int, int]] = None
+_version = 0
+_flushed_version = 0
+_flush_task: Optional[asyncio.Task] = None
+# Set when a change should be persisted without waiting for the flush interval.
+# Created on the first change in an event loop and dropped again by `flush_tasks`.
+_flush_now: Optional[asyncio.Event] = None
+
+def _file_signature() -> Optional[Tuple[int, int]]:
+    try:
+        stat = TASKS_FILE.stat()
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def _load_file() -> Dict[str, Dict]:
     # TODO: Consider adding a file lock to prevent race conditions on concurrent writes
-    with open(TASKS_FILE, 'r', encoding='utf-8') as f:
+    try:
+        with open(TASKS_FILE, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return {}
+    try:
+        tasks = orjson.loads(data)
+    except orjson.JSONDecodeError as e:
+        # Writes are atomic, so this means the file was edited or damaged by hand. Keep a copy
+        # instead of letting the next flush overwrite the tasks with an empty list.
+        backup_path = TASKS_FILE.with_name(f"{TASKS_FILE.name}.corrupt")
+        print(f"Error reading tasks file {TASKS_FILE}: {e}. Starting with an empty queue; the file was kept as {backup_path}.")
         try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            return []
+            os.replace(TASKS_FILE, backup_path)
+        except OSError as move_error:
+            if move_error.errno not in _UNREPLACEABLE_ERRNOS:
+                raise
+            # A bind-mounted tasks.json can't be moved; copying it keeps the content just as well
+            shutil.copyfile(TASKS_FILE, backup_path)
+        return {}
+    return {task["id"]: task for task in tasks}
+
+def _write_file(data: bytes) -> Optional[Tuple[int, int]]:
+    # Write next to the file and swap it in, so a crash mid-write never leaves a truncated tasks.json
+    temp_file = TASKS_FILE.with_name(f"{TASKS_FILE.name}.tmp")
+    with open(temp_file, 'wb') as f:
+        f.write(data)
+        # Make sure the new content is on disk before it replaces the old file; flushes are
+        # coalesced, so this costs one fsync per batch of changes
+        f.flush()
+        os.fsync(f.fileno())
+    try:
+        os.replace(temp_file, TASKS_FILE)
+    except OSError as e:
+        if e.errno not in _UNREPLACEABLE_ERRNOS:
+            raise
+        # tasks.json is a bind-mounted file (see the Docker instructions) and can't be replaced;
+        # fall back to overwriting it in place
+        temp_file.unlink(missing_ok=True)
+        with open(TASKS_FILE, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+    return _file_signature()
+
+def _serialize() -> bytes:
+    return orjson.dumps(list(_tasks.values()), option=orjson.OPT_INDENT_2)
+
+def _current_tasks() -> Dict[str, Dict]:
+    global _tasks, _cached_signature, _version, _flushed_version
+    # Once everything is flushed, tasks.json is authoritative again; reload it if it was
+    # changed or removed by something else (e.g. the test fixtures)
+    if _flushed_version == _version:
+        signature = _file_signature()
+        if _tasks is None or signature != _cached_signature:
+            _tasks = _load_file()
+            _cached_signature = signature
+            # A reload is a change too, as far as `tasks_version` is concerned
+            _version = _flushed_version = _version + 1
+    return _tasks
+
+async def _flush_loop():
+    """Writes the latest version to disk until nothing is left unflushed."""
+    global _cached_signature, _flushed_version, _flush_task
+    try:
+        while _flushed_version != _version:
+            if not _flush_now.is_set():
+                # Only deferred changes so far; give more of them a chance to pile up
+                try:
+                    await asyncio.wait_for(_flush_now.wait(), timeout=TASKS_FLUSH_INTERVAL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+            _flush_now.clear()
+            version, data = _version, _serialize()
+            signature = await asyncio.to_thread(_write_file, data)
+            _cached_signature, _flushed_version = signature, version
+    except Exception as e:
+        print(f"Error writing tasks file {TASKS_FILE}: {e}")
+    finally:
+        _flush_task = None
+
+def _mark_changed(defer_flush: bool = False):
+    global _cached_signature, _version, _flushed_version, _flush_task, _flush_now
+    _version += 1
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # Not called from the event loop (e.g. startup in a worker thread): write through directly
+        _cached_signature = _write_file(_serialize())
+        _flushed_version = _version
+        return
+    if _flush_now is None:
+        _flush_now = asyncio.Event()
+    if not defer_flush:
+        _flush_now.set()
+    if _flush_task is None:
+        _flush_task = loop.create_task(_flush_loop())
+
+def tasks_version() -> int:
+    """Returns a number that changes whenever any task changes, e.g. to build an ETag."""
+    _current_tasks()
+    return _version
+
+def read_tasks() -> List[Dict]:
+    """Returns all tasks in queue order. The dicts are copies; use the write functions to change them."""
+    return [dict(task) for task in _current_tasks().values()]
+
+def get_task(task_id: str) -> Optional[Dict]:
+    """Returns a copy of a single task, or None if it doesn't exist."""
+    task = _current_tasks().get(task_id)
+    return dict(task) if task is not None else None
+
+def client_view(task: Dict, api_token: str) -> Dict:
+    """Returns the task as sent to the client with `api_token`: private fields removed, ownership added."""
+    view = {key: value for key, value in task.items() if key not in PRIVATE_TASK_FIELDS}
+    view["is_owner"] = task.get("api_token") == api_token
+    return view
 
 def write_tasks(tasks: List[Dict]):
-    with open(TASKS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(tasks, f, indent=4, ensure_ascii=False)
+    """Replaces the whole task list."""
+    global _tasks
+    _tasks = {task["id"]: dict(task) for task in tasks}
+    _mark_changed()
+
+def add_task(task: Dict):
+    """Appends a new task to the end of the queue."""
+    _current_tasks()[task["id"]] = dict(task)
+    _mark_changed()
+
+def update_task(task_id: str, changes: Dict[str, Any], defer_flush: bool = False) -> bool:
+    """
+    Applies `changes` to a task in O(1). Returns False if the task no longer exists.
+    With `defer_flush`, the change is persisted with the next periodic flush instead of right away;
+    meant for frequent, low-value updates such as progress.
+    """
+    task = _current_tasks().get(task_id)
+    if task is None:
+        return False
+    task.update(changes)
+    _mark_changed(defer_flush)
+    return True
+
+def remove_task(task_id: str) -> Optional[Dict]:
+    """Removes a task and returns it, or None if it didn't exist."""
+    task = _current_tasks().pop(task_id, None)
+    if task is not None:
+        _mark_changed()
+    return task
+
+async def flush_tasks():
+    """Waits until every pending write has reached tasks.json. Called on application shutdown."""
+    global _flush_now
+    while _flush_task is not None:
+        _flush_now.set()
+        await _flush_task
+    # The event belongs to this event loop; the next one (e.g. after a restart in the same process) creates its own
+    _flush_now = None
 
 def initialize_tasks_file():
     if not TASKS_FILE.exists():
@@ -1,8 +1,12 @@
 
 import pytest
 import os
+import sys
 from pathlib import Path
 
+# Make the application modules importable, however pytest was started
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
 # This fixture will be automatically used by tests in the same directory or subdirectories.
 @pytest.fixture(autouse=True)
 def clean_tasks_before_test():
@@ -3,12 +3,16 @@ import subprocess
 import sys
 from pathlib import Path
 
+# Scripts that talk to a running server and report their result through the exit code;
+# everything else is a pytest module
+SERVER_TEST_SCRIPTS = {"test_idml_tools.py", "test_live_translator.py"}
+
 def run_test(script_path):
     """Runs a python script and returns its exit code."""
     print(f"\n{'='*20} RUNNING TEST: {script_path.name} {'='*20}")
     try:
         # For pytest, we need to call it via the pytest module
-        if 'playwright' in script_path.name:
+        if script_path.name not in SERVER_TEST_SCRIPTS:
             command = [sys.executable, "-m", "pytest", str(script_path)]
         else:
             command = [sys.executable, str(script_path)]
@@ -50,6 +54,11 @@ def main():
         test_dir / "test_idml_tools.py",
         test_dir / "test_live_translator.py",
         test_dir / "test_csv_translator_playwright.py",
+        test_dir / "test_glossary_matcher.py",
+        test_dir / "test_batch_translation.py",
+        test_dir / "test_storage.py",
+        test_dir / "test_idml_cache.py",
+        test_dir / "test_process_csv.py",
     ]
     
     results = {}
@@ -0,0 +1,96 @@
+# test/test_batch_translation.py
+"""
+Checks how multi-text responses are matched up with their texts, and that translate_batch
+falls back to single-text requests whenever that isn't possible.
+"""
+import asyncio
+
+import pytest
+
+import translator
+from translator import _parse_numbered_lines, _strip_added_quotes, translate_batch
+
+class FakeClient:
+    """Answers batch prompts with a fixed response and single-text prompts with the text in upper case."""
+    def __init__(self, batch_response: str):
+        self.batch_response = batch_response
+        self.prompts = []
+
+    async def chat(self, model, messages, options):
+        prompt = messages[0]["content"]
+        self.prompts.append(prompt)
+        if "numbered texts" in prompt:
+            return {"message": {"content": self.batch_response}}
+        text = prompt.rsplit("The text to translate is: ", 1)[1][1:-1]
+        return {"message": {"content": text.upper()}}
+
+@pytest.fixture(autouse=True)
+def empty_translation_cache():
+    translator._translation_cache.clear()
+    yield
+    translator._translation_cache.clear()
+
+# --- _parse_numbered_lines ---
+def test_parses_numbered_lines_in_any_order():
+    assert _parse_numbered_lines("2. zwei\n1) eins\n  3.drei", 3) == ["eins", "zwei", "drei"]
+
+def test_ignores_surrounding_blank_lines_and_whitespace():
+    assert _parse_numbered_lines("\n\n1.  eins  \n2. zwei\n\n", 2) == ["eins", "zwei"]
+
+@pytest.mark.parametrize("content", [
+    "1. eins",                      # too few lines
+    "1. eins\n2. zwei\n3. drei",    # too many lines
+    "1. eins\n3. drei",             # a number is missing
+    "1. eins\n1. noch eins",        # a number is repeated
+    "0. null\n1. eins",             # numbering doesn't start at 1
+])
+def test_rejects_count_mismatches(content):
+    assert _parse_numbered_lines(content, 2) is None
+
+@pytest.mark.parametrize("content", [
+    "1. eins\n   weiter\n2. zwei",  # a translation continued on an unnumbered line
+    "Here you go:\n1. eins\n2. zwei",
+    "1. eins\n2.",                  # an empty translation
+])
+def test_rejects_lines_that_are_not_numbered_translations(content):
+    assert _parse_numbered_lines(content, 2) is None
+
+# --- _strip_added_quotes ---
+@pytest.mark.parametrize("translated, source, expected", [
+    ('"Hallo"', "Hello", "Hallo"),
+    ('"Hallo"', '"Hello"', '"Hallo"'),
+    ('"', "Hello", '"'),
+    ('""', "Hello", ""),
+    ('"Hallo', "Hello", '"Hallo'),
+])
+def test_strip_added_quotes(translated, source, expected):
+    assert _strip_added_quotes(translated, source) == expected
+
+# --- translate_batch ---
+def test_batch_response_is_mapped_back_with_whitespace():
+    client = FakeClient("1. Eins\n2. \"Zwei\"")
+    result = asyncio.run(translate_batch(client, [" one", "two  "], "en", "de", "model"))
+    assert result == [" Eins", "Zwei  "]
+    assert len(client.prompts) == 1
+
+def test_count_mismatch_falls_back_to_single_requests():
+    client = FakeClient("1. Eins")
+    result = asyncio.run(translate_batch(client, ["one", "two"], "en", "de", "model"))
+    assert result == ["ONE", "TWO"]
+    assert len(client.prompts) == 3
+
+def test_multi_line_and_blank_texts_skip_the_batch():
+    client = FakeClient("1. Eins\n2. Zwei")
+    result = asyncio.run(translate_batch(client, ["one", "line one\nline two", "  ", "two"], "en", "de", "model"))
+    assert result == ["Eins", "LINE ONE\nLINE TWO", "  ", "Zwei"]
+    assert "line two" not in client.prompts[0]
+
+def test_batch_results_dont_answer_single_text_requests():
+    client = FakeClient("1. Eins\n2. Zwei")
+    asyncio.run(translate_batch(client, ["one", "two"], "en", "de", "model"))
+    # The same group again is served from the cache...
+    assert asyncio.run(translate_batch(client, ["one", "two"], "en", "de", "model")) == ["Eins", "Zwei"]
+    assert len(client.prompts) == 1
+    # ...but a single text is translated with its own prompt
+    assert asyncio.run(translator.translate_text(client, "one", "en", "de", "model")) == "ONE"
+    assert len(client.prompts) == 2
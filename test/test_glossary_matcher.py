@@ -0,0 +1,76 @@
+# test/test_glossary_matcher.py
+"""
+Checks that GlossaryMatcher.find_terms finds exactly the terms that the original
+per-term search, re.search(r'\b' + re.escape(term) + r'\b', text), found.
+"""
+import re
+
+import pytest
+
+from translator import GlossaryMatcher
+
+GLOSSARY_TERMS = [
+    "Wi-Fi",
+    "Wi-Fi 6",
+    "Fi",
+    "router",
+    "Router",
+    "5GHz",
+    "2.4",
+    "LED_1",
+    "LED",
+    "C++",
+    ".NET",
+    "(beta)",
+    "ÖKO",
+    "設定",
+    "a",
+]
+
+TEXTS = [
+    "",
+    "Wi-Fi",
+    "Connect to Wi-Fi 6 now.",
+    "Wi-Fi6 is not Wi-Fi 6",
+    "WiFi and Wi-Fis",
+    "The router, the Router and the routers.",
+    "router_admin and admin_router",
+    "5GHz band; 25GHz; 5GHzx; (5GHz)",
+    "Version 2.4 vs 12.4 vs 2.45 vs 2.4.1",
+    "LED_1 blinks, LED_10 doesn't, LED does.",
+    "Written in C++ and .NET; not C++11 or ASP.NET",
+    "Feature (beta) and feature(beta)x",
+    "ÖKO-Test and ÖKOlogie",
+    "打開設定頁面",
+    "a b ab ba a_b a1 _a_ à",
+    "Fi-Fi Wi-Fi-Fi",
+]
+
+def regex_terms(terms, text):
+    return [term for term in terms if re.search(r'\b' + re.escape(term) + r'\b', text)]
+
+@pytest.fixture(scope="module")
+def matcher():
+    return GlossaryMatcher({term: {"de": f"{term}-de"} for term in GLOSSARY_TERMS})
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_find_terms_matches_word_boundary_regex(matcher, text):
+    assert matcher.find_terms(text) == regex_terms(GLOSSARY_TERMS, text)
+
+def test_find_terms_reports_each_term_once_in_glossary_order(matcher):
+    assert matcher.find_terms("router LED router LED") == ["router", "LED"]
+
+def test_overlapping_terms_are_all_found(matcher):
+    # "Wi-Fi 6" contains "Wi-Fi" and "Fi", and every one of them sits on word boundaries
+    assert matcher.find_terms("Wi-Fi 6") == ["Wi-Fi", "Wi-Fi 6", "Fi"]
+
+def test_empty_glossary_finds_nothing():
+    assert GlossaryMatcher({}).find_terms("anything") == []
+
+def test_translations_for_skips_missing_values():
+    matcher = GlossaryMatcher({
+        "router": {"de": "Router", "fr": float("nan")},
+        "switch": {"de": None, "fr": "commutateur"},
+    })
+    assert matcher.translations_for("de") == {"router": "Router"}
+    assert matcher.translations_for("fr") == {"switch": "commutateur"}
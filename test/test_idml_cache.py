@@ -0,0 +1,75 @@
+# test/test_idml_cache.py
+"""
+Checks the size-bounded cache of IDML extract/rebuild results in routers/idml.py.
+"""
+import os
+import time
+
+import pytest
+
+from routers import idml
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(idml, "CACHE_DIR", tmp_path)
+    return tmp_path
+
+def cache_entry(cache_dir, name, size, age_seconds):
+    path = cache_dir / name
+    path.write_bytes(b"x" * size)
+    used_at = time.time() - age_seconds
+    os.utime(path, (used_at, used_at))
+    return path
+
+def test_least_recently_used_entries_are_evicted_first(cache_dir):
+    oldest = cache_entry(cache_dir, "a.csv", 100, age_seconds=300)
+    older = cache_entry(cache_dir, "b.csv", 100, age_seconds=200)
+    newest = cache_entry(cache_dir, "c.csv", 100, age_seconds=100)
+    idml._evict_cache_entries(max_bytes=150, grace_seconds=0)
+    assert [oldest.exists(), older.exists(), newest.exists()] == [False, False, True]
+
+def test_nothing_is_evicted_while_the_cache_fits(cache_dir):
+    entries = [cache_entry(cache_dir, f"{name}.csv", 100, age_seconds=300) for name in "ab"]
+    idml._evict_cache_entries(max_bytes=200, grace_seconds=0)
+    assert all(entry.exists() for entry in entries)
+
+def test_recently_used_entries_are_kept_over_the_limit(cache_dir):
+    old = cache_entry(cache_dir, "a.csv", 100, age_seconds=300)
+    recent = cache_entry(cache_dir, "b.csv", 100, age_seconds=5)
+    idml._evict_cache_entries(max_bytes=0, grace_seconds=60)
+    assert [old.exists(), recent.exists()] == [False, True]
+
+def test_temporary_files_are_left_alone(cache_dir):
+    in_progress = cache_entry(cache_dir, "a.csv.0123.tmp", 1000, age_seconds=300)
+    idml._evict_cache_entries(max_bytes=0, grace_seconds=0)
+    assert in_progress.exists()
+
+def test_miss_writes_the_entry_and_hit_reuses_it(cache_dir):
+    cache_path = cache_dir / "digest.csv"
+    calls = []
+
+    def write_output(output_path):
+        calls.append(output_path)
+        output_path.write_text("result")
+
+    idml._ensure_cache_entry(cache_path, write_output)
+    assert cache_path.read_text() == "result"
+    assert len(calls) == 1
+    assert not list(cache_dir.glob("*.tmp"))
+
+    os.utime(cache_path, (0, 0))
+    idml._ensure_cache_entry(cache_path, write_output)
+    assert len(calls) == 1
+    # A hit counts as a use
+    assert cache_path.stat().st_mtime > time.time() - 60
+
+def test_failed_write_leaves_no_entry(cache_dir):
+    cache_path = cache_dir / "digest.csv"
+
+    def write_output(output_path):
+        output_path.write_text("partial")
+        raise ValueError("broken package")
+
+    with pytest.raises(ValueError):
+        idml._ensure_cache_entry(cache_path, write_output)
+    assert list(cache_dir.iterdir()) == []
@@ -8,6 +8,9 @@ import time
 BASE_URL = "http://127.0.0.1:8000"
 API_TOKEN = os.getenv("API_TOKEN", "your_default_token") # Fallback to a default token if not set
 HEADERS = {"X-API-Token": API_TOKEN}
+# One session for all requests, so they reuse the same connection
+session = requests.Session()
+session.headers.update(HEADERS)
 EXAMPLE_DIR = Path(__file__).parent.parent / "example"
 IDML_FILE = EXAMPLE_DIR / "R15_A1_Manual_v1.03(WW).idml"
 CSV_FILE = EXAMPLE_DIR / "R15_A1_Manual_v1.03(WW).csv" # Assuming a translated csv for rebuild test
@@ -26,7 +29,7 @@ def test_idml_extract():
     with open(IDML_FILE, "rb") as f:
         files = {"idml_file": (IDML_FILE.name, f, "application/vnd.adobe.indesign-idml-package")}
         try:
-            response = requests.post(url, headers=HEADERS, files=files, timeout=60)
+            response = session.post(url, files=files, timeout=60)
             
             if response.status_code == 200:
                 print("SUCCESS: Received status 200 OK.")
@@ -67,7 +70,7 @@ def test_idml_rebuild():
             "translated_csv": (CSV_FILE.name, csv_f, "text/csv")
         }
         try:
-            response = requests.post(url, headers=HEADERS, files=files, timeout=60)
+            response = session.post(url, files=files, timeout=60)
             
             if response.status_code == 200:
                 print("SUCCESS: Received status 200 OK.")
@@ -99,8 +102,11 @@ if __name__ == "__main__":
         
     print(f"Using example files from: {EXAMPLE_DIR.resolve()}")
     
-    extract_ok = test_idml_extract()
-    rebuild_ok = test_idml_rebuild()
+    try:
+        extract_ok = test_idml_extract()
+        rebuild_ok = test_idml_rebuild()
+    finally:
+        session.close()
 
     print("\n--- Test Summary ---")
     print(f"IDML Extract: {'PASS' if extract_ok else 'FAIL'}")
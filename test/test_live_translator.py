@@ -9,6 +9,9 @@ HEADERS = {
     "X-API-Token": API_TOKEN,
     "Content-Type": "application/json"
 }
+# One session for all requests, so they reuse the same connection
+session = requests.Session()
+session.headers.update(HEADERS)
 
 def test_live_translation():
     """
@@ -24,7 +27,7 @@ def test_live_translation():
     }
 
     try:
-        response = requests.post(url, headers=HEADERS, json=payload, timeout=30)
+        response = session.post(url, json=payload, timeout=30)
         
         if response.status_code == 200:
             print("SUCCESS: Received status 200 OK.")
@@ -53,7 +56,10 @@ if __name__ == "__main__":
         print("ERROR: API_TOKEN environment variable not set. Please set it before running tests.")
         exit(1)
 
-    translation_ok = test_live_translation()
+    try:
+        translation_ok = test_live_translation()
+    finally:
+        session.close()
 
     print("\n--- Test Summary ---")
     print(f"Live Translation: {'PASS' if translation_ok else 'FAIL'}")
@@ -0,0 +1,74 @@
+# test/test_process_csv.py
+"""
+Checks the translation pipeline of process_csv with a fake Ollama client.
+"""
+import asyncio
+import time
+
+import pandas as pd
+import pytest
+
+import process
+import translator
+
+class FakeClient:
+    """Translates by upper-casing the text, after a short delay."""
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.calls = 0
+
+    async def chat(self, model, messages, options):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.001)
+        self.in_flight -= 1
+        text = messages[0]["content"].rsplit("The text to translate is: ", 1)[1][1:-1]
+        return {"message": {"content": text.upper()}}
+
+@pytest.fixture
+def client(monkeypatch):
+    fake_client = FakeClient()
+    monkeypatch.setattr(process, "get_client", lambda host: fake_client)
+    translator._translation_cache.clear()
+    yield fake_client
+    translator._translation_cache.clear()
+
+def run_process_csv(csv_path, **kwargs):
+    asyncio.run(process.process_csv(csv_path=csv_path, ollama_host="host", model="model", batch_size=10, **kwargs))
+    return pd.read_csv(csv_path.with_name(f"{csv_path.stem}_processed.csv"), dtype=str, encoding='utf-8-sig').fillna('')
+
+def test_translates_empty_cells_of_every_target(tmp_path, client):
+    csv_path = tmp_path / "texts.csv"
+    csv_path.write_text("en,de,fr\nhello,,bonjour\nworld,,\nhello,,\n,,\n", encoding="utf-8")
+    result = run_process_csv(csv_path)
+    assert result["de"].tolist() == ["HELLO", "WORLD", "HELLO", ""]
+    assert result["fr"].tolist() == ["bonjour", "WORLD", "HELLO", ""]
+    # Repeated texts are only sent once per language
+    assert client.calls == 4
+
+def test_requests_are_bounded_by_ollama_num_parallel(tmp_path, client):
+    csv_path = tmp_path / "texts.csv"
+    csv_path.write_text("en,de\n" + "".join(f"text {i},\n" for i in range(200)), encoding="utf-8")
+    result = run_process_csv(csv_path)
+    assert result["de"].tolist() == [f"TEXT {i}" for i in range(200)]
+    assert client.max_in_flight <= process.get_settings().ollama_num_parallel
+
+def test_translation_continues_during_checkpoint_writes(tmp_path, client, monkeypatch):
+    monkeypatch.setattr(process, "CHECKPOINT_INTERVAL_SECONDS", 0)
+    calls_during_writes = []
+    to_csv = pd.DataFrame.to_csv
+
+    def slow_to_csv(df, *args, **kwargs):
+        calls_before = client.calls
+        time.sleep(0.05)
+        calls_during_writes.append(client.calls - calls_before)
+        return to_csv(df, *args, **kwargs)
+
+    monkeypatch.setattr(pd.DataFrame, "to_csv", slow_to_csv)
+    csv_path = tmp_path / "texts.csv"
+    csv_path.write_text("en,de\n" + "".join(f"text {i},\n" for i in range(300)), encoding="utf-8")
+    result = run_process_csv(csv_path)
+    assert result["de"].tolist() == [f"TEXT {i}" for i in range(300)]
+    assert max(calls_during_writes) > 0
@@ -0,0 +1,113 @@
+# test/test_storage.py
+"""
+Checks the in-memory task store: background flushes, picking up changes made to tasks.json
+by others, and the in-place fallback for a tasks.json that can't be replaced.
+"""
+import asyncio
+import errno
+import os
+
+import orjson
+import pytest
+
+import storage
+
+@pytest.fixture
+def tasks_file(tmp_path, monkeypatch):
+    """Points the store at a fresh tasks.json and resets its in-memory state."""
+    path = tmp_path / "tasks.json"
+    monkeypatch.setattr(storage, "TASKS_FILE", path)
+    monkeypatch.setattr(storage, "TASKS_FLUSH_INTERVAL_SECONDS", 0.05)
+    for name, value in (("_tasks", None), ("_cached_signature", None), ("_version", 0),
+                        ("_flushed_version", 0), ("_flush_task", None), ("_flush_now", None)):
+        monkeypatch.setattr(storage, name, value)
+    return path
+
+def task(task_id, status="pending"):
+    return {"id": task_id, "status": status}
+
+def file_tasks(path):
+    return orjson.loads(path.read_bytes())
+
+def test_writes_outside_the_event_loop_go_straight_to_disk(tasks_file):
+    storage.add_task(task("a"))
+    assert file_tasks(tasks_file) == [task("a")]
+
+def test_changes_are_flushed_in_the_background(tasks_file):
+    # Runs in a worker thread on startup, so it writes the file right away
+    storage.initialize_tasks_file()
+
+    async def scenario():
+        storage.add_task(task("a"))
+        storage.add_task(task("b"))
+        storage.update_task("a", {"status": "running"})
+        # Nothing is written before the event loop gets a chance to run the flush
+        assert file_tasks(tasks_file) == []
+        await storage.flush_tasks()
+        assert file_tasks(tasks_file) == [task("a", "running"), task("b")]
+
+    asyncio.run(scenario())
+
+def test_deferred_changes_are_flushed_after_the_interval(tasks_file):
+    async def scenario():
+        storage.add_task(task("a"))
+        await storage.flush_tasks()
+        storage.update_task("a", {"progress": 5}, defer_flush=True)
+        await asyncio.sleep(0.2)
+        assert file_tasks(tasks_file) == [{**task("a"), "progress": 5}]
+        await storage.flush_tasks()
+
+    asyncio.run(scenario())
+
+def test_store_works_again_on_a_new_event_loop(tasks_file):
+    for status in ("running", "completed"):
+        async def scenario():
+            storage.write_tasks([task("a", status)])
+            await storage.flush_tasks()
+
+        asyncio.run(scenario())
+        assert file_tasks(tasks_file) == [task("a", status)]
+
+def test_external_edit_is_picked_up(tasks_file):
+    storage.write_tasks([task("a")])
+    version = storage.tasks_version()
+    tasks_file.write_bytes(orjson.dumps([task("a", "completed"), task("b")]))
+    assert storage.read_tasks() == [task("a", "completed"), task("b")]
+    assert storage.tasks_version() != version
+
+def test_removed_file_means_no_tasks(tasks_file):
+    storage.write_tasks([task("a")])
+    tasks_file.unlink()
+    assert storage.read_tasks() == []
+    assert storage.get_task("a") is None
+
+def test_reads_return_copies(tasks_file):
+    storage.write_tasks([task("a")])
+    storage.get_task("a")["status"] = "changed"
+    storage.read_tasks()[0]["status"] = "changed"
+    assert storage.get_task("a") == task("a")
+
+def test_corrupt_file_is_kept_as_a_backup(tasks_file):
+    tasks_file.write_bytes(b"[{not json")
+    assert storage.read_tasks() == []
+    assert tasks_file.with_name("tasks.json.corrupt").read_bytes() == b"[{not json"
+
+@pytest.mark.parametrize("error_number", [errno.EBUSY, errno.EXDEV])
+def test_unreplaceable_file_is_overwritten_in_place(tasks_file, monkeypatch, error_number):
+    storage.write_tasks([task("a")])
+
+    def replace(source, destination):
+        raise OSError(error_number, os.strerror(error_number))
+
+    monkeypatch.setattr(storage.os, "replace", replace)
+    storage.write_tasks([task("a", "completed")])
+    assert file_tasks(tasks_file) == [task("a", "completed")]
+    assert not tasks_file.with_name("tasks.json.tmp").exists()
+
+def test_other_replace_errors_are_raised(tasks_file, monkeypatch):
+    def replace(source, destination):
+        raise OSError(errno.EACCES, os.strerror(errno.EACCES))
+
+    monkeypatch.setattr(storage.os, "replace", replace)
+    with pytest.raises(PermissionError):
+        storage.write_tasks([task("a")])
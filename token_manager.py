@@ -1,9 +1,9 @@
 # token_manager.py
-import json
+import orjson
 import secrets
 import sys
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import Any, Dict, List, Optional, Tuple
 
 TOKEN_FILE = Path("api_tokens.json")
 
@@ -14,18 +14,35 @@ def initialize_token_file():
         default_token = {"name": "default-user", "token": "replace-with-your-real-api-token"}
         save_token_objects([default_token])
 
-def get_token_objects() -> List[Dict[str, Any]]:
-    """Reads the list of token objects from the JSON file."""
-    if not TOKEN_FILE.exists():
-        return []
+# The parsed file, reused until its (mtime_ns, size) changes
+_cached_token_objects: List[Dict[str, Any]] = []
+_cached_signature: Optional[Tuple[int, int]] = None
+
+def _read_token_objects() -> List[Dict[str, Any]]:
     try:
-        with open(TOKEN_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        with open(TOKEN_FILE, 'rb') as f:
+            data = orjson.loads(f.read())
             if isinstance(data, list):
                 return data
             return []
-    except (json.JSONDecodeError, IOError):
+    except (orjson.JSONDecodeError, IOError):
+        return []
+
+def get_token_objects() -> List[Dict[str, Any]]:
+    """
+    Reads the list of token objects from the JSON file.
+    The file is only parsed again after it changed, so repeated calls cost a single stat().
+    """
+    global _cached_token_objects, _cached_signature
+    try:
+        stat = TOKEN_FILE.stat()
+    except FileNotFoundError:
         return []
+    signature = (stat.st_mtime_ns, stat.st_size)
+    if signature != _cached_signature:
+        _cached_token_objects, _cached_signature = _read_token_objects(), signature
+    # A copy, so callers can append to it before saving
+    return list(_cached_token_objects)
 
 def get_tokens() -> List[str]:
     """Extracts just the token strings from the token objects."""
@@ -34,41 +51,57 @@ def get_tokens() -> List[str]:
 
 def save_token_objects(tokens: List[Dict[str, Any]]):
     """Saves a list of token objects to the JSON file."""
+    # Serialized up front and written with a single write().
+    # Written in place rather than swapped in with os.replace: the Docker setup bind-mounts this one file.
+    data = orjson.dumps(tokens, option=orjson.OPT_INDENT_2)
     try:
-        with open(TOKEN_FILE, 'w', encoding='utf-8') as f:
-            json.dump(tokens, f, indent=2)
+        with open(TOKEN_FILE, 'wb') as f:
+            f.write(data)
     except IOError as e:
         print(f"Error saving token file: {e}")
 
 def add_token(username: str):
     """Generates a new token for a user and adds it to the file."""
-    if not username:
-        print("Error: Username cannot be empty.", file=sys.stderr)
-        return
+    add_tokens([username])
 
+def add_tokens(usernames: List[str]):
+    """
+    Generates a new token for each user and adds them to the file.
+    The file is read and saved once for all of them, so bulk onboarding doesn't rewrite it per user.
+    """
     token_objects = get_token_objects()
-    
-    # Check if username already exists
-    if any(obj.get("name") == username for obj in token_objects):
-        print(f"Error: User '{username}' already exists.", file=sys.stderr)
-        return
+    existing_usernames = {obj.get("name") for obj in token_objects if isinstance(obj, dict)}
+    added = []
+    for username in usernames:
+        if not username:
+            print("Error: Username cannot be empty.", file=sys.stderr)
+            continue
+        # Check if username already exists (also among the ones added in this call)
+        if username in existing_usernames:
+            print(f"Error: User '{username}' already exists.", file=sys.stderr)
+            continue
+
+        # Generate a new, URL-safe token
+        new_token = secrets.token_urlsafe(32)
+        token_objects.append({"name": username, "token": new_token})
+        existing_usernames.add(username)
+        added.append((username, new_token))
 
-    # Generate a new, URL-safe token
-    new_token = secrets.token_urlsafe(32)
-    
-    token_objects.append({"name": username, "token": new_token})
+    if not added:
+        return
     save_token_objects(token_objects)
-    print(f"Successfully added token for user '{username}'.")
-    print(f"New Token: {new_token}")
+    for username, new_token in added:
+        print(f"Successfully added token for user '{username}'.")
+        print(f"New Token: {new_token}")
 
 if __name__ == "__main__":
-    # Allows running as a script: python -m token_manager add <username>
-    if len(sys.argv) == 3 and sys.argv[1] == 'add':
-        username_to_add = sys.argv[2]
+    # Allows running as a script: python -m token_manager add <username> [<username> ...]
+    if len(sys.argv) >= 3 and sys.argv[1] == 'add':
+        usernames_to_add = sys.argv[2:]
         # Ensure the file exists before trying to add to it
         if not TOKEN_FILE.exists():
             initialize_token_file()
-        add_token(username_to_add)
+        add_tokens(usernames_to_add)
     else:
-        print("Usage: python -m token_manager add <username>", file=sys.stderr)
+        print("Usage: python -m token_manager add <username> [<username> ...]", file=sys.stderr)
         sys.exit(1)
\ No newline at end of file
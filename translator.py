@@ -1,8 +1,210 @@
 import asyncio
-import ollama
+import hashlib
 import re
-import pandas as pd
-from typing import Dict, Optional
+import ahocorasick
+import httpx
+import ollama
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Union
+
+# --- Shared Ollama clients ---
+# Every AsyncClient owns its own httpx connection pool, so we keep one client per host
+# and reuse it instead of paying connection setup on every request.
+_clients: Dict[str, ollama.AsyncClient] = {}
+# Keep enough idle connections around that parallel requests never have to reconnect
+OLLAMA_POOL_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+OLLAMA_WARM_UP_TIMEOUT_SECONDS = 10
+
+def get_client(host: str) -> ollama.AsyncClient:
+    """Returns the shared AsyncClient for the given Ollama host, creating it on first use."""
+    client = _clients.get(host)
+    if client is None:
+        client = _clients[host] = ollama.AsyncClient(host=host, timeout=None, limits=OLLAMA_POOL_LIMITS)
+    return client
+
+async def warm_up_client(host: str, model: str):
+    """
+    Opens a pooled connection to Ollama with a cheap `list()` call, so the first translation
+    doesn't pay for the handshake. Also warns early if the configured model isn't available.
+    Failures are only logged; Ollama may simply not be up yet.
+    """
+    try:
+        response = await asyncio.wait_for(get_client(host).list(), timeout=OLLAMA_WARM_UP_TIMEOUT_SECONDS)
+    except Exception as e:
+        print(f"Warning: Could not reach Ollama at {host} during startup: {e!r}")
+        return
+    available_models = {entry.model for entry in response.models}
+    if model not in available_models and f"{model}:latest" not in available_models:
+        print(f"Warning: Model '{model}' is not available on {host}. Available models: {', '.join(sorted(available_models)) or 'none'}")
+
+async def close_clients():
+    """Closes all shared clients. Called on application shutdown."""
+    for client in _clients.values():
+        await client.close()
+    _clients.clear()
+
+# --- Translation cache ---
+# Finished translations are remembered per model and prompt, so a string that shows up again
+# (in another task, a re-uploaded file or the live translator) doesn't go to the LLM again.
+# The prompt covers the languages, the glossary rules and the text, so they all count.
+TRANSLATION_CACHE_SIZE = 50_000
+_translation_cache: "OrderedDict[Tuple[str, bytes], str]" = OrderedDict()
+# Requests that are in flight right now. Concurrent tasks often translate the same strings at the
+# same time; they wait for the first request instead of sending their own. Resolves to None
+# if that request fails or is cancelled.
+_pending_translations: "Dict[Tuple[str, bytes], asyncio.Future[Optional[str]]]" = {}
+
+def _translation_cache_key(model: str, prompt: str) -> Tuple[str, bytes]:
+    # Prompts are long; a digest keeps the cache small
+    return model, hashlib.blake2b(prompt.encode(), digest_size=16).digest()
+
+def _remember_translation(key: Tuple[str, bytes], translation: str):
+    _translation_cache[key] = translation
+    _translation_cache.move_to_end(key)
+    if len(_translation_cache) > TRANSLATION_CACHE_SIZE:
+        _translation_cache.popitem(last=False)
+
+# --- Glossary matching ---
+def _is_missing(value) -> bool:
+    # Empty glossary cells are read as NaN, the only value that isn't equal to itself
+    return value is None or value != value
+
+def _is_word_char(char: str) -> bool:
+    # Same definition of a word character as the `\w` class used by `re`
+    return char.isalnum() or char == '_'
+
+class GlossaryMatcher:
+    """
+    Finds the glossary terms that occur in a text with a single Aho-Corasick scan.
+    Build it once per glossary; a term only counts as found where it starts and ends on
+    a word boundary, exactly like searching for r'\b' + re.escape(term) + r'\b'.
+    """
+    def __init__(self, glossary: Dict[str, Dict[str, str]]):
+        self.glossary = glossary
+        self._automaton = ahocorasick.Automaton()
+        for order, term in enumerate(glossary):
+            if isinstance(term, str) and term:
+                self._automaton.add_word(term, (order, term))
+        self._is_empty = len(self._automaton) == 0
+        if not self._is_empty:
+            self._automaton.make_automaton()
+        self._translations_by_lang: Dict[str, Dict[str, str]] = {}
+        # Composed prompt rule sections by (target_lang, terms), filled in by `_rules_section`.
+        # Kept on the matcher, so they go away together with it.
+        self.rules_sections: Dict[Tuple[str, Tuple[str, ...]], str] = {}
+
+    def translations_for(self, target_lang: str) -> Dict[str, str]:
+        """
+        Returns a flat {term: translation} dict for `target_lang`, built on first use and then reused.
+        Terms without a translation into that language are left out.
+        """
+        translations = self._translations_by_lang.get(target_lang)
+        if translations is None:
+            translations = self._translations_by_lang[target_lang] = {
+                term: value
+                for term, row in self.glossary.items()
+                if row and (value := row.get(target_lang)) and not _is_missing(value)
+            }
+        return translations
+
+    def find_terms(self, text: str) -> List[str]:
+        """Returns the glossary terms found in `text`, in glossary order."""
+        if self._is_empty:
+            return []
+        found = set()
+        for end_index, (order, term) in self._automaton.iter(text):
+            start_index = end_index - len(term) + 1
+            # A word boundary sits between a word and a non-word character (or the text edge)
+            before = start_index > 0 and _is_word_char(text[start_index - 1])
+            after = end_index + 1 < len(text) and _is_word_char(text[end_index + 1])
+            if before != _is_word_char(term[0]) and after != _is_word_char(term[-1]):
+                found.add((order, term))
+        return [term for _, term in sorted(found)]
+
+# --- Prompts ---
+GENERAL_RULES = (
+    "- Keep all Arabic numerals (0–9) unchanged.\n"
+    "- Keep terms with numbers + units unchanged (e.g., mW, mHz, Mbps, dBm, GHz, MHz).\n"
+    "- Keep acronyms/abbreviations in ALL CAPS unchanged (e.g., SSID, WPS, QoS).\n"
+)
+
+def _as_matcher(glossary: Optional[Union[GlossaryMatcher, Dict[str, Dict[str, str]]]]) -> Optional[GlossaryMatcher]:
+    if glossary and not isinstance(glossary, GlossaryMatcher):
+        return GlossaryMatcher(glossary)
+    return glossary or None
+
+# How many composed rule sections one GlossaryMatcher keeps
+RULES_SECTION_CACHE_SIZE = 4096
+
+# Without glossary hits, every prompt gets the same rules
+NO_GLOSSARY_RULES_SECTION = (
+    "Follow these non-translation rules:\n\n"
+    + GENERAL_RULES
+)
+
+def _rules_section(glossary: Optional[GlossaryMatcher], texts: List[str], target_lang: str) -> str:
+    """Builds the rules part of a prompt, with a glossary rule for every term found in `texts`."""
+    if glossary:
+        terms = tuple(dict.fromkeys(term for text in texts for term in glossary.find_terms(text)))
+        if terms:
+            # The same few terms recur across a file's texts, so the composed section is reused
+            key = (target_lang, terms)
+            section = glossary.rules_sections.get(key)
+            if section is None:
+                section = _glossary_rules_section(glossary, target_lang, terms)
+                if len(glossary.rules_sections) < RULES_SECTION_CACHE_SIZE:
+                    glossary.rules_sections[key] = section
+            return section
+    return NO_GLOSSARY_RULES_SECTION
+
+def _glossary_rules_section(glossary: GlossaryMatcher, target_lang: str, terms: Tuple[str, ...]) -> str:
+    lang_translations = glossary.translations_for(target_lang)
+    prompt_instructions = []
+    for term in terms:
+        target_translation = lang_translations.get(term)
+        if target_translation:
+            prompt_instructions.append(
+                f"- Always translate '{term}' (case-sensitive) as '{target_translation}'."
+            )
+        else:
+            prompt_instructions.append(
+                f"- Do not translate '{term}'; keep it exactly as written, including its original capitalization (case-sensitive)."
+            )
+    return (
+        "Follow these rules in order of priority:\n\n"
+        "1. Glossary rules (highest priority):\n"
+        + "\n".join(prompt_instructions)
+        + "\n\n"
+        "2. Then apply the general non-translation rules:\n"
+        + GENERAL_RULES
+    )
+
+def _single_text_prompt(stripped_text: str, source_lang: str, target_lang: str, glossary: Optional[GlossaryMatcher]) -> str:
+    return (
+        f"Translate the following text from {source_lang} to {target_lang}.\n\n"
+        f"{_rules_section(glossary, [stripped_text], target_lang)}\n"
+        f"Both {source_lang} and {target_lang} are specified using BCP 47 language codes "
+        f"(e.g., en, fr-FR, fr-CA, pt-BR, zh-Hant, zh-Hans).\n"
+        f"Do not provide any explanation or extra text, only output the translation.\n\n"
+        f"The text to translate is: \"{stripped_text}\"" # Use stripped text for translation
+    )
+
+def _strip_added_quotes(translated_text: str, stripped_text: str) -> str:
+    # Handle quotes: only remove if LLM added them and original (stripped) text didn't have them.
+    # The length check keeps a lone '"' answer from being emptied.
+    if len(translated_text) >= 2 and translated_text[0] == '"' == translated_text[-1]:
+        if not (stripped_text[0] == '"' == stripped_text[-1]):
+            return translated_text[1:-1]
+    return translated_text
+
+def _split_whitespace(text: str) -> Tuple[str, str, str]:
+    """Splits `text` into its leading whitespace, the stripped text and its trailing whitespace."""
+    stripped_text = text.strip()
+    if not stripped_text:
+        return text, "", ""
+    leading_whitespace = text[:len(text) - len(text.lstrip())]
+    trailing_whitespace = text[len(text.rstrip()):]
+    return leading_whitespace, stripped_text, trailing_whitespace
 
 async def translate_text(
     client: ollama.AsyncClient,
@@ -10,78 +212,45 @@ async def translate_text(
     source_lang: str,
     target_lang: str,
     model: str,
-    glossary: Optional[Dict[str, Dict[str, str]]] = None
+    glossary: Optional[Union[GlossaryMatcher, Dict[str, Dict[str, str]]]] = None
 ) -> str:
     """
     使用指定的Ollama模型非同步翻譯單一文本。
     新增 glossary 參數以處理特定字詞的翻譯規則。
+    Pass a prebuilt GlossaryMatcher when translating many texts with the same glossary.
     """
-    # --- Start of new whitespace handling ---
-    # 1. Manually handle whitespace to ensure reliable formatting
-    stripped_text = text_to_translate.strip()
+    # Manually handle whitespace to ensure reliable formatting
+    leading_whitespace, stripped_text, trailing_whitespace = _split_whitespace(text_to_translate)
     if not stripped_text:
         return text_to_translate # Return original string if it's all whitespace
 
-    leading_whitespace = text_to_translate[:len(text_to_translate) - len(text_to_translate.lstrip())]
-    trailing_whitespace = text_to_translate[len(text_to_translate.rstrip()):]
-    # --- End of new whitespace handling ---
+    prompt = _single_text_prompt(stripped_text, source_lang, target_lang, _as_matcher(glossary))
 
-    prompt_instructions = []
-    if glossary and stripped_text:
-        for term, translations in glossary.items():
-            if re.search(r'\b' + re.escape(term) + r'\b', stripped_text):
-                target_translation = translations.get(target_lang)
-                if target_translation and not pd.isna(target_translation):
-                    prompt_instructions.append(
-                        f"- Always translate '{term}' (case-sensitive) as '{target_translation}'."
-                    )
-                else:
-                    prompt_instructions.append(
-                        f"- Do not translate '{term}'; keep it exactly as written, including its original capitalization (case-sensitive)."
-                    )
-
-    general_rules = (
-        "- Keep all Arabic numerals (0–9) unchanged.\n"
-        "- Keep terms with numbers + units unchanged (e.g., mW, mHz, Mbps, dBm, GHz, MHz).\n"
-        "- Keep acronyms/abbreviations in ALL CAPS unchanged (e.g., SSID, WPS, QoS).\n"
-    )
+    cache_key = _translation_cache_key(model, prompt)
+    cached_translation = _translation_cache.get(cache_key)
+    if cached_translation is not None:
+        _translation_cache.move_to_end(cache_key)
+        return leading_whitespace + cached_translation + trailing_whitespace
 
-    if prompt_instructions:
-        rules_section = (
-            "Follow these rules in order of priority:\n\n"
-            "1. Glossary rules (highest priority):\n"
-            + "\n".join(prompt_instructions)
-            + "\n\n"
-            "2. Then apply the general non-translation rules:\n"
-            + general_rules
-        )
-    else:
-        rules_section = (
-            "Follow these non-translation rules:\n\n"
-            + general_rules
-        )
-
-    prompt = (
-        f"Translate the following text from {source_lang} to {target_lang}.\n\n"
-        f"{rules_section}\n"
-        f"Both {source_lang} and {target_lang} are specified using BCP 47 language codes "
-        f"(e.g., en, fr-FR, fr-CA, pt-BR, zh-Hant, zh-Hans).\n"
-        f"Do not provide any explanation or extra text, only output the translation.\n\n"
-        f"The text to translate is: \"{stripped_text}\"" # Use stripped text for translation
-    )
+    pending_translation = _pending_translations.get(cache_key)
+    if pending_translation is not None:
+        # Shielded, so cancelling this caller doesn't resolve the shared future for the others
+        shared_translation = await asyncio.shield(pending_translation)
+        if shared_translation is not None:
+            return leading_whitespace + shared_translation + trailing_whitespace
+        # The shared request failed; fall through and make our own
 
+    pending_translation = _pending_translations[cache_key] = asyncio.get_running_loop().create_future()
     try:
         response = await client.chat(
             model=model,
             messages=[{"role": "user", "content": prompt}],
             options={"temperature": 0.5, "top_p": 0.95},
         )
-        translated_text = response["message"]["content"]
-        
-        # Handle quotes: only remove if LLM added them and original (stripped) text didn't have them.
-        if translated_text.startswith('"') and translated_text.endswith('"'):
-            if not (stripped_text.startswith('"') and stripped_text.endswith('"')):
-                translated_text = translated_text[1:-1]
+        translated_text = _strip_added_quotes(response["message"]["content"], stripped_text)
+        # Failed requests return the source text below and are never cached
+        _remember_translation(cache_key, translated_text)
+        pending_translation.set_result(translated_text)
         
         # Re-apply original whitespace
         final_translation = leading_whitespace + translated_text + trailing_whitespace
@@ -90,4 +259,106 @@ async def translate_text(
     except Exception as e:
         print(f"An error occurred while translating '{stripped_text}': {e}")
         # On error, return the original text with its whitespace
-        return text_to_translate
\ No newline at end of file
+        return text_to_translate
+
+    finally:
+        if _pending_translations.get(cache_key) is pending_translation:
+            del _pending_translations[cache_key]
+        if not pending_translation.done():
+            pending_translation.set_result(None)
+
+# --- Multi-text requests ---
+_NUMBERED_LINE = re.compile(r"^\s*(\d+)[.)]\s?(.*)$")
+
+def _batch_prompt(stripped_texts: List[str], source_lang: str, target_lang: str, glossary: Optional[GlossaryMatcher]) -> str:
+    numbered_texts = "\n".join(f"{number}. {text}" for number, text in enumerate(stripped_texts, start=1))
+    return (
+        f"Translate each of the following {len(stripped_texts)} numbered texts from {source_lang} to {target_lang}.\n\n"
+        f"{_rules_section(glossary, stripped_texts, target_lang)}\n"
+        f"Both {source_lang} and {target_lang} are specified using BCP 47 language codes "
+        f"(e.g., en, fr-FR, fr-CA, pt-BR, zh-Hant, zh-Hans).\n"
+        f"Do not provide any explanation or extra text. Output exactly {len(stripped_texts)} lines in the same order, "
+        f"each one being the number of the text, a period and its translation.\n\n"
+        f"The texts to translate are:\n{numbered_texts}"
+    )
+
+def _parse_numbered_lines(content: str, count: int) -> Optional[List[str]]:
+    """Returns the `count` translations in a numbered response, or None if it doesn't have exactly those."""
+    translations: Dict[int, str] = {}
+    for line in content.strip().splitlines():
+        match = _NUMBERED_LINE.match(line)
+        if not match or not match.group(2).strip():
+            return None
+        translations[int(match.group(1))] = match.group(2).strip()
+    if sorted(translations) != list(range(1, count + 1)):
+        return None
+    return [translations[number] for number in range(1, count + 1)]
+
+async def translate_batch(
+    client: ollama.AsyncClient,
+    texts: List[str],
+    source_lang: str,
+    target_lang: str,
+    model: str,
+    glossary: Optional[Union[GlossaryMatcher, Dict[str, Dict[str, str]]]] = None
+) -> List[str]:
+    """
+    Translates several texts with a single Ollama request, which saves the per-request overhead
+    for short texts. Texts already translated by `translate_text` are taken from its cache; texts
+    that span several lines or can't be matched up in the response are translated one by one.
+    """
+    glossary = _as_matcher(glossary)
+    results: List[Optional[str]] = [None] * len(texts)
+    batched: List[Tuple[int, str]] = []
+    for index, text in enumerate(texts):
+        leading_whitespace, stripped_text, trailing_whitespace = _split_whitespace(text)
+        if not stripped_text:
+            results[index] = text
+            continue
+        if "\n" in stripped_text:
+            continue
+        # A translation made for the text on its own is just as good here
+        cache_key = _translation_cache_key(model, _single_text_prompt(stripped_text, source_lang, target_lang, glossary))
+        cached_translation = _translation_cache.get(cache_key)
+        if cached_translation is not None:
+            _translation_cache.move_to_end(cache_key)
+            results[index] = leading_whitespace + cached_translation + trailing_whitespace
+        else:
+            batched.append((index, stripped_text))
+
+    if len(batched) > 1:
+        stripped_texts = [stripped_text for _, stripped_text in batched]
+        batch_prompt = _batch_prompt(stripped_texts, source_lang, target_lang, glossary)
+        # The batch prompt carries the glossary rules of the whole group, so its results depend on
+        # which texts were grouped together. They are cached under that prompt only and never
+        # answer a single-text request.
+        batch_cache_key = _translation_cache_key(model, batch_prompt)
+        cached_batch = _translation_cache.get(batch_cache_key)
+        if cached_batch is not None:
+            _translation_cache.move_to_end(batch_cache_key)
+            translations = cached_batch.split("\n")
+        else:
+            try:
+                response = await client.chat(
+                    model=model,
+                    messages=[{"role": "user", "content": batch_prompt}],
+                    options={"temperature": 0.5, "top_p": 0.95},
+                )
+                translations = _parse_numbered_lines(response["message"]["content"], len(batched))
+            except Exception as e:
+                print(f"An error occurred while translating a batch of {len(batched)} texts: {e}")
+                translations = None
+            if translations is not None:
+                # Parsed translations are single lines, so they can be stored as one string
+                _remember_translation(batch_cache_key, "\n".join(translations))
+        if translations is not None:
+            for (index, stripped_text), translated_text in zip(batched, translations):
+                translated_text = _strip_added_quotes(translated_text, stripped_text)
+                leading_whitespace, _, trailing_whitespace = _split_whitespace(texts[index])
+                results[index] = leading_whitespace + translated_text + trailing_whitespace
+
+    # Everything left over goes through the regular single-text path
+    for index, text in enumerate(texts):
+        if results[index] is None:
+            results[index] = await translate_text(client, text, source_lang, target_lang, model, glossary=glossary)
+    return results
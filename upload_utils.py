@@ -0,0 +1,161 @@
+# upload_utils.py
+import asyncio
+import hashlib
+import shutil
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Dict, Optional, Set
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from starlette.status import HTTP_413_CONTENT_TOO_LARGE, HTTP_503_SERVICE_UNAVAILABLE
+
+from settings import get_settings
+from storage import read_tasks
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+
+# --- Back-pressure ---
+# How long a request waits for a free upload slot before it is turned away
+UPLOAD_SLOT_TIMEOUT_SECONDS = 1
+_upload_semaphore: Optional[asyncio.Semaphore] = None
+
+def init_upload_slots():
+    """Creates the upload slots for the running event loop. Called on application startup."""
+    global _upload_semaphore
+    _upload_semaphore = asyncio.Semaphore(get_settings().max_concurrent_uploads)
+
+async def upload_slot() -> AsyncIterator[None]:
+    """
+    FastAPI dependency that caps how many upload or IDML requests are processed at once
+    (MAX_CONCURRENT_UPLOADS), so a burst of large files doesn't hash, copy and parse them all
+    in parallel. Responds with 503 if no slot frees up in time.
+    It only runs once Starlette has received and spooled the whole request body, so it doesn't
+    limit how many bodies are being received; UploadSizeLimitMiddleware bounds their size.
+    """
+    try:
+        await asyncio.wait_for(_upload_semaphore.acquire(), timeout=UPLOAD_SLOT_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=HTTP_503_SERVICE_UNAVAILABLE, detail="The server is busy, please try again shortly.")
+    try:
+        yield
+    finally:
+        _upload_semaphore.release()
+
+# --- Size limits ---
+def _upload_too_large(max_bytes: int) -> HTTPException:
+    limit_mb = max_bytes // (1024 * 1024)
+    return HTTPException(status_code=HTTP_413_CONTENT_TOO_LARGE, detail=f"The upload exceeds the {limit_mb} MB limit.")
+
+class UploadSizeLimitMiddleware:
+    """
+    Rejects requests to the upload endpoints in `limits` (path -> max bytes) whose Content-Length
+    exceeds that path's limit with a 413, before their body is read and spooled to disk.
+    Other paths aren't limited. Requests without a Content-Length (chunked uploads)
+    are still caught file by file in `hash_upload_file`.
+    """
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        max_bytes = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if max_bytes is not None:
+            for name, value in scope["headers"]:
+                if name == b"content-length":
+                    if value.isdigit() and int(value) > max_bytes:
+                        error = _upload_too_large(max_bytes)
+                        response = JSONResponse({"detail": error.detail}, status_code=error.status_code)
+                        await response(scope, receive, send)
+                        return
+                    break
+        await self.app(scope, receive, send)
+
+@lru_cache(maxsize=None)
+def _ensure_dir(directory: Path) -> Path:
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+def task_upload_dir(upload_dir: Path, task_id: str) -> Path:
+    """
+    Returns the subdirectory of `upload_dir` that holds a task's files, sharded by the
+    first two characters of the task id so no single directory grows without bound.
+    """
+    return _ensure_dir(upload_dir / task_id[:2])
+
+def _copy_to_file(source: BinaryIO, destination: Path):
+    with open(destination, "wb") as buffer:
+        shutil.copyfileobj(source, buffer, UPLOAD_CHUNK_SIZE)
+
+async def save_upload_file(upload_file: UploadFile, destination: Path):
+    """
+    Streams an uploaded file to disk in fixed-size chunks.
+    Memory use stays constant regardless of the file size. The whole copy runs in one
+    worker thread straight from the spooled upload, so the event loop is never blocked.
+    Uploads are hashed once beforehand with `hash_upload_file`, which also rewinds them.
+    """
+    await asyncio.to_thread(_copy_to_file, upload_file.file, destination)
+
+def _digest_and_rewind(source: BinaryIO, max_bytes: int) -> str:
+    digest = hashlib.sha256()
+    total = 0
+    while chunk := source.read(UPLOAD_CHUNK_SIZE):
+        total += len(chunk)
+        if total > max_bytes:
+            raise _upload_too_large(max_bytes)
+        digest.update(chunk)
+    source.seek(0)
+    return digest.hexdigest()
+
+async def hash_upload_file(upload_file: UploadFile, max_bytes: int) -> str:
+    """
+    Returns the SHA-256 hex digest of an upload without copying it anywhere.
+    The spooled file is rewound afterwards, so it can be handed to a processor via `upload_source`.
+    Every upload is hashed before it is used, so this is also where files over `max_bytes`
+    (MAX_UPLOAD_MB or MAX_IDML_UPLOAD_MB) are rejected with a 413, before anything is written.
+    """
+    return await asyncio.to_thread(_digest_and_rewind, upload_file.file, max_bytes)
+
+def upload_source(upload_file: UploadFile) -> BinaryIO:
+    """
+    Returns a seekable file object for reading an upload in place (e.g. with zipfile or pandas).
+    """
+    spooled = upload_file.file
+    if hasattr(spooled, "seekable"):
+        return spooled
+    # Before Python 3.11, SpooledTemporaryFile lacks seekable(), which zipfile needs; the
+    # wrapped BytesIO (small uploads) or temporary file (large ones) has it
+    return spooled._file
+
+# --- Garbage Collection ---
+UPLOAD_GC_INTERVAL_SECONDS = 60 * 60
+# Unreferenced files (leftover temp files, old cache entries) are removed after this long
+UPLOAD_MAX_AGE_SECONDS = 24 * 60 * 60
+
+def sweep_stale_uploads(upload_dir: Path, live_task_ids: Set[str], max_age: float = UPLOAD_MAX_AGE_SECONDS) -> int:
+    """
+    Deletes files below `upload_dir` that are older than `max_age` seconds and don't belong
+    to a task in storage. Task files are all named `{task_id}_...`. Returns the number removed.
+    """
+    cutoff = time.time() - max_age
+    removed = 0
+    for path in upload_dir.rglob("*"):
+        if path.name.split("_", 1)[0] in live_task_ids:
+            continue
+        try:
+            if path.is_file() and path.stat().st_mtime < cutoff:
+                path.unlink(missing_ok=True)
+                removed += 1
+        except OSError as e:
+            print(f"Error removing stale upload {path}: {e}")
+    return removed
+
+async def run_upload_gc(upload_dir: Path):
+    """Periodically removes abandoned files from the uploads directory."""
+    while True:
+        live_task_ids = {task["id"] for task in read_tasks()}
+        removed = await asyncio.to_thread(sweep_stale_uploads, upload_dir, live_task_ids)
+        if removed:
+            print(f"Removed {removed} stale file(s) from {upload_dir}.")
+        await asyncio.sleep(UPLOAD_GC_INTERVAL_SECONDS)
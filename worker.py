@@ -1,105 +1,175 @@
 # worker.py
 import asyncio
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 from process import process_csv
-from storage import read_tasks, write_tasks
+from settings import get_settings
+from storage import read_tasks, get_task, update_task, remove_task
 
 # This state is now local to the worker
 running_async_tasks: Dict[str, asyncio.Task[Any]] = {}
 
+# Ids of pending tasks in queue order. The worker blocks on this queue, so a new task
+# starts right away and an idle worker does no work at all. A queue belongs to the event loop
+# it is first used on, so every start of the worker creates its own, see `start_background_worker`.
+_pending_task_ids: Optional[asyncio.Queue] = None
+
+def enqueue_task(task_id: str):
+    """Hands a newly added pending task to the worker."""
+    _pending_task_ids.put_nowait(task_id)
+
+# Set on application shutdown. Tasks cancelled by it are put back in the queue for the next
+# start; only deleting a task marks it as cancelled.
+_shutting_down = False
+
+def start_background_worker(manager) -> asyncio.Task:
+    """Creates the task queue on the running event loop and starts the background worker. Called on application startup."""
+    global _pending_task_ids, _shutting_down
+    _pending_task_ids = asyncio.Queue()
+    _shutting_down = False
+    return asyncio.create_task(run_background_worker(manager))
+
+async def stop_background_worker(worker_task: asyncio.Task):
+    """
+    Stops the worker and every task it is running. The tasks are set back to "pending",
+    so they resume on the next start. Called on application shutdown.
+    """
+    global _shutting_down
+    _shutting_down = True
+    worker_task.cancel()
+    running_tasks = list(running_async_tasks.values())
+    if running_tasks:
+        print(f"Cancelling {len(running_tasks)} running tasks...")
+        for task in running_tasks:
+            task.cancel()
+    # Wait until the worker has stored the final states, so they make it into the last flush
+    await asyncio.gather(worker_task, *running_tasks, return_exceptions=True)
+
+class ProgressReporter:
+    """
+    The `progress_callback` handed to `process_csv` for one task. Progress is only persisted
+    with the next periodic flush, clients only get the changed field instead of the whole
+    task list, and a report that repeats the previous one is dropped.
+    """
+    def __init__(self, task_id: str, manager):
+        self.task_id = task_id
+        self.manager = manager
+        self._last_reported = None
+
+    async def __call__(self, processed: int, total: int):
+        if (processed, total) == self._last_reported:
+            return
+        self._last_reported = (processed, total)
+        progress = {"processed": processed, "total": total}
+        if update_task(self.task_id, {"progress": progress}, defer_flush=True):
+            await self.manager.broadcast_patch(self.task_id, {"progress": progress})
+
 async def run_background_worker(manager):
     """
-    The main background worker loop.
+    The main background worker: recovers the queue, then runs DINGO_WORKERS task loops concurrently.
     """
     print("Background worker started.")
+
+    # --- Crash Recovery ---
+    # A task still marked "running" at startup was interrupted by a crash or restart.
+    # Requeue it; otherwise it would block the queue forever.
+    interrupted_tasks = [task for task in read_tasks() if task["status"] == "running"]
+    if interrupted_tasks:
+        for task in interrupted_tasks:
+            print(f"Task {task['id']} was interrupted, requeueing it.")
+            update_task(task["id"], {"status": "pending"})
+        await manager.broadcast_tasks()
+
+    # A task still "uploading" lost its files to a crash mid-upload; drop it. The partial
+    # files belong to no task anymore, so the upload GC removes them.
+    for task in read_tasks():
+        if task["status"] == "uploading":
+            print(f"Task {task['id']} was interrupted during its upload, removing it.")
+            remove_task(task["id"])
+
+    # Queue everything that was left pending, in its original order
+    for task in read_tasks():
+        if task["status"] == "pending":
+            enqueue_task(task["id"])
+
+    # Every loop takes the next task off the shared queue as soon as its current one is done
+    worker_count = get_settings().worker_count
+    print(f"Processing up to {worker_count} task(s) at a time.")
+    await asyncio.gather(*(_process_queue(manager) for _ in range(worker_count)))
+
+async def _process_queue(manager):
+    """Runs queued tasks one after another until the worker is cancelled."""
     while True:
-        tasks = read_tasks()
-
-        # --- Task Cancellation Check ---
-        # If a task is in our running list but not in storage anymore (e.g., deleted by user), cancel it.
-        running_ids = set(running_async_tasks.keys())
-        task_ids_in_storage = {t['id'] for t in tasks}
-        
-        for task_id in running_ids - task_ids_in_storage:
-            print(f"Task {task_id} not found in storage, requesting cancellation.")
-            if task_id in running_async_tasks:
-                running_async_tasks[task_id].cancel()
-                # The main try/except/finally block below will handle the cleanup.
-
-        # --- New Task Execution ---
-        # Check if any task is currently running
-        is_task_running = any(task["status"] == "running" for task in tasks)
-
-        if not is_task_running:
-            pending_task = next((task for task in tasks if task["status"] == "pending"), None)
-            
-            if pending_task:
-                task_id = pending_task['id']
-                print(f"Worker picked up task: {task_id} (type: {pending_task.get('file_type')})")
-
-                # Update task status to "running"
-                for task in tasks:
-                    if task['id'] == task_id:
-                        task["status"] = "running"
-                write_tasks(tasks)
-                await manager.broadcast_tasks()
-
-                async def progress_callback(processed, total):
-                    current_tasks = read_tasks()
-                    task_to_update = next((t for t in current_tasks if t["id"] == task_id), None)
-                    if task_to_update:
-                        task_to_update["progress"] = {"processed": processed, "total": total}
-                        write_tasks(current_tasks)
-                        await manager.broadcast_tasks()
-
-                glossary_path_str = pending_task.get("glossary_path")
-                glossary_path = Path(glossary_path_str) if glossary_path_str else None
-
-                # Create and store the asyncio task
-                process_task = asyncio.create_task(
-                    process_csv(
-                        csv_path=Path(pending_task["filepath"]),
-                        progress_callback=progress_callback,
-                        ollama_host=pending_task.get("ollama_host"),
-                        model=pending_task.get("model"),
-                        batch_size=pending_task.get("batch_size", 10),
-                        glossary_path=glossary_path
-                    )
-                )
-                running_async_tasks[task_id] = process_task
-
-                final_status = ""
-                try:
-                    await process_task
-                    final_status = "completed"
-                except asyncio.CancelledError:
-                    print(f"Task {task_id} was cancelled.")
-                    final_status = "cancelled"
-                except Exception as e:
-                    print(f"Task {task_id} failed: {e}")
-                    final_status = "error"
-                    error_msg = str(e)
-                finally:
-                    # Clean up the task from the running list
-                    if task_id in running_async_tasks:
-                        del running_async_tasks[task_id]
-                    
-                    # Update the final status in storage, but only if the task hasn't been deleted
-                    current_tasks = read_tasks()
-                    task_to_update = next((t for t in current_tasks if t["id"] == task_id), None)
-
-                    if task_to_update:
-                        task_to_update["status"] = final_status
-                        if final_status == "error":
-                            task_to_update["error_message"] = error_msg
-                        write_tasks(current_tasks)
-                    
-                    # Notify clients of the final status
-                    await manager.broadcast_tasks()
-
-        await asyncio.sleep(5)
+        task_id = await _pending_task_ids.get()
+        try:
+            await _run_task(task_id, manager)
+        except Exception as e:
+            # Keep the loop alive; one broken task mustn't stop the others from being processed
+            print(f"Worker error while handling task {task_id}: {e!r}")
+
+async def _run_task(task_id: str, manager):
+    """Runs a single queued task and stores its final status."""
+    # --- New Task Execution ---
+    # Deleting a running task cancels it directly (see routers/tasks.py)
+    pending_task = get_task(task_id)
+
+    # Skip tasks that were deleted while they were waiting
+    if not pending_task or pending_task["status"] != "pending":
+        return
+
+    print(f"Worker picked up task: {task_id} (type: {pending_task.get('file_type')})")
+
+    # Update task status to "running"
+    update_task(task_id, {"status": "running"})
+    await manager.broadcast_tasks()
+
+    glossary_path_str = pending_task.get("glossary_path")
+    glossary_path = Path(glossary_path_str) if glossary_path_str else None
+
+    # Create and store the asyncio task
+    process_task = asyncio.create_task(
+        process_csv(
+            csv_path=Path(pending_task["filepath"]),
+            progress_callback=ProgressReporter(task_id, manager),
+            ollama_host=pending_task.get("ollama_host"),
+            model=pending_task.get("model"),
+            batch_size=pending_task.get("batch_size", 10),
+            glossary_path=glossary_path
+        )
+    )
+    running_async_tasks[task_id] = process_task
+
+    try:
+        # `asyncio.wait` doesn't raise the task's own cancellation, so a CancelledError
+        # here always means that the worker itself is being stopped
+        await asyncio.wait({process_task})
+    except asyncio.CancelledError:
+        process_task.cancel()
+        await asyncio.wait({process_task})
+        raise
+    finally:
+        # Clean up the task from the running list
+        running_async_tasks.pop(task_id, None)
+
+        # Update the final status in storage, but only if the task hasn't been deleted
+        update_task(task_id, _final_changes(task_id, process_task))
+
+        # Notify clients of the final status
+        await manager.broadcast_tasks()
+
+def _final_changes(task_id: str, process_task: asyncio.Task) -> Dict[str, Any]:
+    if not process_task.done() or process_task.cancelled():
+        if _shutting_down:
+            print(f"Task {task_id} was stopped by the shutdown; it will resume on the next start.")
+            return {"status": "pending"}
+        print(f"Task {task_id} was cancelled.")
+        return {"status": "cancelled"}
+    error = process_task.exception()
+    if error is not None:
+        print(f"Task {task_id} failed: {error}")
+        return {"status": "error", "error_message": str(error)}
+    return {"status": "completed"}
 
 def get_running_tasks_dict():
     """Returns the dictionary of running asyncio tasks for cancellation."""